@@ -0,0 +1,149 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+INDEX_VERSION_FILE = "index_version"
+
+_PUNCTUATION = re.compile(r"[\s\?？!！。．.,，、~～]+")
+
+
+def normalize_question(text):
+    """去除大小寫、空白與標點差異，讓「請問年假幾天?」與「請問年假幾天」視為同一題"""
+    return _PUNCTUATION.sub(" ", text.lower()).strip()
+
+
+def bump_index_version(db_path):
+    """向量資料庫重建後呼叫，讓所有 SemanticAnswerCache 失效"""
+    os.makedirs(db_path, exist_ok=True)
+    with open(os.path.join(db_path, INDEX_VERSION_FILE), "w", encoding="utf-8") as f:
+        f.write(str(time.time_ns()))
+
+
+def read_index_version(db_path):
+    try:
+        with open(os.path.join(db_path, INDEX_VERSION_FILE), encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class SemanticAnswerCache:
+    """
+    以問題的 embedding 作為 key 的回答快取
+    - 正規化後完全相同的問題直接命中，不需計算 embedding
+    - 否則與已快取問題做 cosine similarity，超過 threshold 即命中
+    - 每筆有 TTL，超過容量時以 LRU 淘汰
+    - chroma_db 的 index_version 改變（build_database.py 重建）時整個清空
+    """
+
+    def __init__(self, embed_fn, db_path, threshold=0.95, max_entries=1000, ttl=86400):
+        self.embed_fn = embed_fn
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # normalized question -> entry
+        self._lock = threading.Lock()
+        self._version = read_index_version(db_path)
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        version = read_index_version(self.db_path)
+        if version != self._version:
+            self._version = version
+            if self._entries:
+                print("向量資料庫已重建，清空回答快取")
+                self._entries.clear()
+                self.invalidations += 1
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, question):
+        return self._unit(self.embed_fn(normalize_question(question)))
+
+    def lookup(self, question, vector=None):
+        """
+        查詢快取，回傳 (entry 或 None, 問題向量)
+        vector: 呼叫端已經算好的問題向量（會再正規化）
+        回傳的向量可以直接沿用於後續檢索，避免重複計算 embedding
+        """
+        key = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.exact_hits += 1
+                return entry, entry["vector"]
+
+        vector = self.embed(question) if vector is None else self._unit(vector)
+
+        with self._lock:
+            best_key, best_score = None, -1.0
+            if self._entries:
+                keys = list(self._entries.keys())
+                matrix = np.stack([self._entries[k]["vector"] for k in keys])
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                best_key, best_score = keys[best], float(scores[best])
+
+            if best_key is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return self._entries[best_key], vector
+
+            self.misses += 1
+            return None, vector
+
+    def store(self, question, vector, answer, rag_used):
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = {
+                "vector": vector,
+                "answer": answer,
+                "rag": rag_used,
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "exact_hits": self.exact_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
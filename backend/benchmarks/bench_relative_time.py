@@ -0,0 +1,115 @@
+"""
+相對時間格式化的 micro-benchmark：MySQL TIMESTAMPDIFF CASE vs Python apply_relative_time
+
+用法（在 backend 目錄下）:
+    python benchmarks/bench_relative_time.py --rows 10000 --repeat 20
+
+沒有可用的 MySQL（.env 的 DB_* 設定）時只量測 Python 端
+"""
+import os
+import sys
+import random
+import argparse
+import statistics
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timefmt import apply_relative_time, db_now  # noqa: E402
+
+SQL_CASE = """
+    SELECT id, created_at,
+           CASE
+               WHEN TIMESTAMPDIFF(MINUTE, created_at, NOW()) < 1 THEN '剛剛'
+               WHEN TIMESTAMPDIFF(MINUTE, created_at, NOW()) < 60
+                   THEN CONCAT(TIMESTAMPDIFF(MINUTE, created_at, NOW()), ' 分鐘前')
+               WHEN TIMESTAMPDIFF(HOUR, created_at, NOW()) < 24
+                   THEN CONCAT(TIMESTAMPDIFF(HOUR, created_at, NOW()), ' 小時前')
+               ELSE CONCAT(TIMESTAMPDIFF(DAY, created_at, NOW()), ' 天前')
+           END as time
+    FROM bench_relative_time
+"""
+SQL_RAW = "SELECT id, created_at FROM bench_relative_time"
+
+
+def sample_times(rows):
+    now = db_now()
+    # 分散在 0 秒 ~ 30 天前，四種格式都會出現
+    return [now - timedelta(seconds=random.randint(0, 30 * 86400)) for _ in range(rows)]
+
+
+def measure(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations), min(durations)
+
+
+def report(label, result):
+    median, best = result
+    print(f"{label:<36} median {median:8.2f} ms   best {best:8.2f} ms")
+
+
+def bench_python(rows, repeat):
+    times = sample_times(rows)
+    data = [{"id": i, "created_at": t} for i, t in enumerate(times)]
+    report(f"Python 格式化 ({rows} 筆)", measure(lambda: apply_relative_time(data), repeat))
+    report(f"Python 格式化 en ({rows} 筆)", measure(lambda: apply_relative_time(data, locale="en"), repeat))
+    return times
+
+
+def bench_mysql(times, repeat):
+    try:
+        import mysql.connector
+        from db import DB_CONFIG
+        conn = mysql.connector.connect(**DB_CONFIG)
+    except Exception as err:
+        print(f"略過 MySQL 量測（無法連線: {err}）")
+        return
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            CREATE TEMPORARY TABLE bench_relative_time (
+                id INT PRIMARY KEY,
+                created_at TIMESTAMP NOT NULL
+            )
+        """)
+        cursor.executemany(
+            "INSERT INTO bench_relative_time (id, created_at) VALUES (%s, %s)",
+            [(i, t) for i, t in enumerate(times)],
+        )
+        conn.commit()
+
+        def sql_side():
+            cursor.execute(SQL_CASE)
+            cursor.fetchall()
+
+        def python_side():
+            cursor.execute(SQL_RAW)
+            apply_relative_time(cursor.fetchall())
+
+        report(f"MySQL CASE 查詢+取回 ({len(times)} 筆)", measure(sql_side, repeat))
+        report(f"MySQL 原始查詢+Python 格式化 ({len(times)} 筆)", measure(python_side, repeat))
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="相對時間格式化 benchmark")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--python-only", action="store_true", help="不連線 MySQL")
+    args = parser.parse_args()
+
+    times = bench_python(args.rows, args.repeat)
+    if not args.python_only:
+        bench_mysql(times, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+以假 LLM 啟動後端，供 load_test.py 壓測
+
+用法（在 backend 目錄下，先以 seed_bench_db.py 建好測試資料庫）:
+    python benchmarks/bench_server.py --db-name workmate_bench --port 8001 --first-token-ms 800
+
+資料庫連線沿用 .env 的 DB_HOST / DB_USER / DB_PASSWORD，只把資料庫換成 --db-name
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以假 LLM 啟動後端（壓測用）")
+    parser.add_argument("--db-name", default="workmate_bench")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--first-token-ms", type=float, default=800.0, help="假 LLM 第一個片段前的延遲")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="假 LLM 之後每個片段的間隔")
+    parser.add_argument("--chunks", type=int, default=20, help="假 LLM 回覆的片段數")
+    parser.add_argument("--fake-embeddings", action="store_true", help="不載入 HuggingFace 模型，改用假 embedding")
+    parser.add_argument("--no-answer-cache", action="store_true", help="關閉回答快取與 FAQ，每題都經過 LLM")
+    args = parser.parse_args()
+
+    # 必須在 import main / db 之前設定（load_dotenv 不會覆寫已存在的環境變數）
+    os.environ["DB_NAME"] = args.db_name
+    if args.no_answer_cache:
+        os.environ["ANSWER_CACHE_ENABLED"] = "false"
+        os.environ["FAQ_ENABLED"] = "false"
+
+    import uvicorn
+    from fake_llm import FakeChatModel, fake_embeddings
+    from rag import rag_service
+
+    rag_service.llm_factory = lambda: FakeChatModel(
+        first_token_ms=args.first_token_ms, token_ms=args.token_ms, chunks=args.chunks
+    )
+    if args.fake_embeddings:
+        rag_service.embeddings_factory = fake_embeddings
+
+    from main import app
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
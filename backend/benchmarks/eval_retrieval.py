@@ -0,0 +1,281 @@
+"""
+檢索品質與延遲的離線評估：recall@k、MRR、問題 embedding 時間、搜尋時間、索引大小與記憶體
+
+以知識庫的 Q: 行產生評估題目（原題 + 規則改寫），對 build_database.py 建好的 chroma_db 檢索，
+看正確的 Q&A 區塊排在第幾名。只使用 CPU 與本機已下載的模型，不連網。
+
+用法（在 backend 目錄下）:
+    python benchmarks/eval_retrieval.py
+    python benchmarks/eval_retrieval.py --modes vector,hybrid --ks 1,3,5,10 --json eval.json
+    python benchmarks/eval_retrieval.py --db-path chroma_db_bge --model BAAI/bge-small-zh-v1.5
+    python benchmarks/eval_retrieval.py --eval-set my_eval.jsonl   # 加入人工改寫的題目
+
+--eval-set 每行一筆 {"query": "...", "question": "知識庫中對應的原題"}
+"""
+import os
+import re
+import sys
+import json
+import time
+import resource
+import argparse
+import statistics
+
+# 一律離線：模型必須已在本機快取
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_huggingface import HuggingFaceEmbeddings  # noqa: E402
+from langchain_community.vectorstores import Chroma  # noqa: E402
+from langchain_core.documents import Document  # noqa: E402
+
+from answer_cache import normalize_question  # noqa: E402
+from build_database import DATA_PATH, DB_PATH, list_data_files, _load_file  # noqa: E402
+from faq_index import split_qa  # noqa: E402
+from keyword_index import KeywordIndex, KEYWORD_INDEX_FILE  # noqa: E402
+from rag import EMBEDDING_MODEL  # noqa: E402
+from retrieval import RetrievalBudget, search_with_scores, fuse_keyword_scores, retrieve_context, _dedup_key  # noqa: E402
+
+# 規則改寫：模擬使用者換個說法問同一題
+_SYNONYMS = [
+    ("有哪些", "有什麼"), ("什麼", "啥"), ("如何", "怎麼"), ("可以", "能"), ("公司", "我們公司"),
+    ("申請", "辦理"), ("補助", "補貼"), ("員工", "同仁"), ("是否", "是不是"),
+]
+_FILLER = re.compile(r"^(請問|我想要了解|我想了解|我想學習|我想要|我想|想問一下|聽說)[，,、]?")
+_ENDING = re.compile(r"[？?。!！]+$")
+
+
+def paraphrases(question):
+    """回傳 [(改寫方式, 題目)]，內容與原題相同的改寫會略過"""
+    base = _ENDING.sub("", question.strip())
+    variants = [("original", question.strip())]
+
+    synonym = base
+    for old, new in _SYNONYMS:
+        synonym = synonym.replace(old, new)
+    variants.append(("synonym", synonym + "？"))
+
+    stripped = _FILLER.sub("", base)
+    variants.append(("casual", f"想問一下，{stripped}呢"))
+
+    # 只留前半句，模擬打字打一半或很短的提問
+    half = stripped[:max(4, len(stripped) // 2)]
+    variants.append(("partial", half))
+
+    seen = set()
+    result = []
+    for kind, text in variants:
+        key = normalize_question(text)
+        if key and key not in seen:
+            seen.add(key)
+            result.append((kind, text))
+    return result
+
+
+def load_corpus(data_path):
+    """回傳 {Q&A id: (問題, 內容)}，與 build_database.py 的切分與 ID 完全相同"""
+    corpus = {}
+    for filepath in list_data_files(data_path):
+        _, chunks = _load_file(filepath)
+        for doc_id, content, _ in chunks:
+            qa = split_qa(content)
+            if qa is not None:
+                corpus[doc_id] = (qa[0], content)
+    return corpus
+
+
+def build_eval_set(corpus, extra_path=None):
+    by_question = {normalize_question(question): doc_id for doc_id, (question, _) in corpus.items()}
+    items = []
+    for doc_id, (question, _) in corpus.items():
+        for kind, query in paraphrases(question):
+            items.append({"query": query, "kind": kind, "target": doc_id})
+    if extra_path:
+        with open(extra_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                target = by_question.get(normalize_question(row["question"]))
+                if target is None:
+                    print(f"略過：知識庫中找不到原題「{row['question']}」")
+                    continue
+                items.append({"query": row["query"], "kind": "manual", "target": target})
+    return items
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def rss_mb():
+    # Linux 的 ru_maxrss 單位是 KB（macOS 是 bytes）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def rank_of(target_content, docs):
+    key = _dedup_key(target_content)
+    for rank, doc in enumerate(docs, start=1):
+        if _dedup_key(doc.page_content) == key:
+            return rank
+    return None
+
+
+def evaluate(mode, items, corpus, db, embeddings, keyword_index, budget, ks):
+    ranks, embed_ms, search_ms = [], [], []
+    selected_chunks, selected_tokens, selected_hits = [], [], 0
+    by_kind = {}
+    for item in items:
+        vector = None
+        if mode != "keyword":
+            started = time.perf_counter()
+            vector = embeddings.embed_query(normalize_question(item["query"]))
+            embed_ms.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        if mode == "keyword":
+            hits = keyword_index.search(item["query"], budget.fetch_k)
+            docs = [Document(page_content=keyword_index.contents[pos]) for pos, _ in hits]
+        else:
+            scored = search_with_scores(db, item["query"], budget.fetch_k, vector)
+            if mode == "hybrid":
+                scored = fuse_keyword_scores(db, keyword_index, item["query"], scored, budget, vector)
+            scored.sort(key=lambda pair: pair[1], reverse=True)
+            docs = [doc for doc, _ in scored]
+        search_ms.append((time.perf_counter() - started) * 1000)
+
+        target_content = corpus[item["target"]][1]
+        rank = rank_of(target_content, docs)
+        ranks.append(rank)
+        by_kind.setdefault(item["kind"], []).append(rank)
+
+        if mode != "keyword":
+            # 實際送進 prompt 的區塊（門檻、差距、token 上限之後）
+            selection = retrieve_context(db, item["query"], budget, vector, keyword_index if mode == "hybrid" else None)
+            selected_chunks.append(len(selection["docs"]))
+            selected_tokens.append(selection["tokens"])
+            selected_hits += rank_of(target_content, selection["docs"]) is not None
+
+    def recall(values, k):
+        return round(sum(1 for r in values if r is not None and r <= k) / len(values), 4)
+
+    def mrr(values):
+        return round(sum(1 / r for r in values if r is not None) / len(values), 4)
+
+    result = {
+        "queries": len(items),
+        "recall": {f"@{k}": recall(ranks, k) for k in ks},
+        "mrr": mrr(ranks),
+        "by_kind": {
+            kind: {"queries": len(values), **{f"recall@{k}": recall(values, k) for k in ks}, "mrr": mrr(values)}
+            for kind, values in sorted(by_kind.items())
+        },
+        "embed_ms": _latency(embed_ms),
+        "search_ms": _latency(search_ms),
+    }
+    if selected_chunks:
+        result["context"] = {
+            "hit_rate": round(selected_hits / len(items), 4),
+            "avg_chunks": round(statistics.mean(selected_chunks), 2),
+            "avg_tokens": round(statistics.mean(selected_tokens), 1),
+        }
+    return result
+
+
+def _latency(samples):
+    if not samples:
+        return {"avg": None, "p50": None, "p95": None}
+    samples = sorted(samples)
+    return {
+        "avg": round(statistics.mean(samples), 3),
+        "p50": round(samples[len(samples) // 2], 3),
+        "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def print_report(report, ks):
+    print(f"\n模型 {report['model']}，{report['index']['vectors']} 個向量，"
+          f"chroma_db {report['index']['chroma_mb']} MB，關鍵字索引 {report['index']['keyword_index_mb']} MB，"
+          f"記憶體峰值 {report['memory']['peak_rss_mb']} MB（模型 +{report['memory']['model_mb']} MB）")
+    header = f"{'mode':<9}" + "".join(f"{'R@' + str(k):>8}" for k in ks) + f"{'MRR':>8}{'embed p50':>11}{'search p50':>12}{'ctx hit':>9}{'chunks':>8}{'tokens':>8}"
+    print(header)
+    print("-" * len(header))
+    for mode, result in report["modes"].items():
+        context = result.get("context", {})
+        print(f"{mode:<9}" + "".join(f"{result['recall']['@' + str(k)]:>8}" for k in ks)
+              + f"{result['mrr']:>8}{str(result['embed_ms']['p50'] or '-'):>11}{result['search_ms']['p50']:>12}"
+              + f"{context.get('hit_rate', '-'):>9}{context.get('avg_chunks', '-'):>8}{context.get('avg_tokens', '-'):>8}")
+    print("（時間單位: ms；ctx hit = 正確區塊有進入最後送給 LLM 的上下文）")
+    for mode, result in report["modes"].items():
+        print(f"\n[{mode}] 依改寫方式:")
+        for kind, row in result["by_kind"].items():
+            recalls = " ".join(f"R@{k}={row[f'recall@{k}']}" for k in ks)
+            print(f"  {kind:<9} n={row['queries']:<5} {recalls} MRR={row['mrr']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="檢索品質與延遲的離線評估")
+    parser.add_argument("--data-path", default=DATA_PATH)
+    parser.add_argument("--db-path", default=DB_PATH)
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="必須與建立 db-path 時的模型相同")
+    parser.add_argument("--modes", default="vector,hybrid,keyword")
+    parser.add_argument("--ks", default="1,3,5,10,20")
+    parser.add_argument("--fetch-k", type=int, default=None, help="候選數（預設同 RAG_FETCH_K）")
+    parser.add_argument("--eval-set", help="額外的人工評估題目（JSON lines）")
+    parser.add_argument("--limit", type=int, default=0, help="只評估前 N 題（快速檢查用）")
+    parser.add_argument("--json", help="把結果寫到指定的 JSON 檔")
+    args = parser.parse_args()
+
+    ks = [int(k) for k in args.ks.split(",")]
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    budget = RetrievalBudget.from_env()
+    budget.fetch_k = args.fetch_k or max(budget.fetch_k, max(ks))
+
+    corpus = load_corpus(args.data_path)
+    items = build_eval_set(corpus, args.eval_set)
+    if args.limit:
+        items = items[:args.limit]
+    print(f"知識庫 {len(corpus)} 題，評估題目 {len(items)} 題")
+
+    rss_before = rss_mb()
+    embeddings = HuggingFaceEmbeddings(model_name=args.model, model_kwargs={"device": "cpu"})
+    embeddings.embed_query("warmup")
+    model_mb = round(rss_mb() - rss_before, 1)
+
+    db = Chroma(persist_directory=args.db_path, embedding_function=embeddings)
+    keyword_index = KeywordIndex.load(args.db_path)
+    if keyword_index is None:
+        modes = [mode for mode in modes if mode == "vector"]
+
+    report = {
+        "model": args.model,
+        "db_path": args.db_path,
+        "fetch_k": budget.fetch_k,
+        "index": {
+            "vectors": db._collection.count(),
+            "chroma_mb": round(dir_size(args.db_path) / 1024 / 1024, 2),
+            "keyword_index_mb": round(os.path.getsize(os.path.join(args.db_path, KEYWORD_INDEX_FILE)) / 1024 / 1024, 2)
+            if keyword_index is not None else None,
+        },
+        "modes": {},
+    }
+    for mode in modes:
+        print(f"評估 {mode}...")
+        report["modes"][mode] = evaluate(mode, items, corpus, db, embeddings, keyword_index, budget, ks)
+    report["memory"] = {"peak_rss_mb": rss_mb(), "model_mb": model_mb}
+
+    print_report(report, ks)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+壓力測試用的假模型：取代 gpt-4o，回覆內容固定（依 prompt 雜湊產生）且延遲可設定
+"""
+import time
+import asyncio
+import hashlib
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    - first_token_ms: 第一個片段前的延遲（模擬 TTFT）
+    - token_ms: 之後每個片段的間隔
+    - chunks: 回覆切成幾個片段
+    """
+
+    first_token_ms: float = 800.0
+    token_ms: float = 20.0
+    chunks: int = 20
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _pieces(self, messages):
+        prompt = "".join(str(message.content) for message in messages)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return [f"[fake-{digest}]"] + [f" 測試片段{i}" for i in range(1, self.chunks)]
+
+    def _total_seconds(self):
+        return (self.first_token_ms + self.token_ms * (self.chunks - 1)) / 1000
+
+    def _result(self, messages):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._pieces(messages))))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._total_seconds())
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._total_seconds())
+        return self._result(messages)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for i, piece in enumerate(self._pieces(messages)):
+            time.sleep((self.first_token_ms if i == 0 else self.token_ms) / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for i, piece in enumerate(self._pieces(messages)):
+            await asyncio.sleep((self.first_token_ms if i == 0 else self.token_ms) / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+
+def fake_embeddings(size=384):
+    """與 all-MiniLM-L6-v2 同維度的假 embedding，不需要下載模型"""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    return DeterministicFakeEmbedding(size=size)
@@ -0,0 +1,288 @@
+"""
+後端壓力測試：依權重混合呼叫各 API，回報每個端點的 p50 / p95 / p99 與 req/s
+
+用法（在 backend 目錄下，先啟動 benchmarks/bench_server.py）:
+    python benchmarks/load_test.py --base-url http://127.0.0.1:8001 --concurrency 50 --duration 60
+    python benchmarks/load_test.py --mix chat=1 --concurrency 20 --requests 500
+    python benchmarks/load_test.py --json results.json   # 輸出結果，方便比較不同版本
+
+需要 httpx（pip install httpx）
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import LatencyTracker  # noqa: E402
+
+DEFAULT_MIX = {
+    "posts": 30,
+    "posts_hydrated": 10,
+    "notifications": 20,
+    "unread_count": 10,
+    "dashboard_notifications": 10,
+    "popular_posts": 10,
+    "like": 5,
+    "chat": 5,
+    "chat_stream": 0,
+}
+
+FALLBACK_QUESTIONS = [
+    "新進員工剛進公司需要哪些導引訓練？",
+    "公司有員工購股計畫嗎？",
+    "諮商的費用如何計算？",
+    "我最近壓力很大，該怎麼辦？",
+    "年假可以累積到明年嗎？",
+]
+
+
+def load_questions(path):
+    """以知識庫的 Q: 行作為聊天題目，另外混入一些知識庫沒有的問題"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            questions = [line.strip()[2:].strip() for line in f if line.strip()[:2] in ("Q:", "Q：")]
+    except OSError:
+        questions = []
+    return questions + FALLBACK_QUESTIONS
+
+
+class Context:
+    def __init__(self, args, rng):
+        self.args = args
+        self.rng = rng
+        self.session_id = uuid.uuid4().hex
+        self.post_ids = args.post_ids
+        self.questions = args.questions
+
+    def user_id(self):
+        return self.rng.randint(1, self.args.max_user_id)
+
+
+# 每個情境回傳 (端點名稱, response)
+async def scenario_posts(client, ctx):
+    return "GET /api/posts", await client.get("/api/posts", params={"limit": 20, "user_id": ctx.user_id()})
+
+
+async def scenario_posts_hydrated(client, ctx):
+    params = {"limit": 20, "hydrate": "true", "user_id": ctx.user_id()}
+    return "GET /api/posts?hydrate", await client.get("/api/posts", params=params)
+
+
+async def scenario_notifications(client, ctx):
+    params = {"limit": 20, "user_id": ctx.user_id()}
+    return "GET /api/notifications", await client.get("/api/notifications", params=params)
+
+
+async def scenario_unread_count(client, ctx):
+    params = {"user_id": ctx.user_id()}
+    return "GET /api/notifications/unread-count", await client.get("/api/notifications/unread-count", params=params)
+
+
+async def scenario_dashboard_notifications(client, ctx):
+    headers = {"X-User-ID": str(ctx.user_id())}
+    return "GET /api/dashboard/notifications", await client.get("/api/dashboard/notifications", headers=headers)
+
+
+async def scenario_popular_posts(client, ctx):
+    return "GET /api/dashboard/popular-posts", await client.get("/api/dashboard/popular-posts")
+
+
+async def scenario_like(client, ctx):
+    post_id = ctx.rng.choice(ctx.post_ids)
+    params = {"user_id": ctx.user_id()}
+    return "POST /api/posts/{id}/like", await client.post(f"/api/posts/{post_id}/like", params=params)
+
+
+def _chat_body(ctx):
+    return {
+        "message": ctx.rng.choice(ctx.questions),
+        "session_id": ctx.session_id,
+        "user_id": ctx.user_id(),
+    }
+
+
+async def scenario_chat(client, ctx):
+    return "POST /api/chat", await client.post("/api/chat", json=_chat_body(ctx), timeout=ctx.args.chat_timeout)
+
+
+async def scenario_chat_stream(client, ctx):
+    # 讀完整個串流才算完成
+    async with client.stream("POST", "/api/chat/stream", json=_chat_body(ctx), timeout=ctx.args.chat_timeout) as response:
+        async for _ in response.aiter_bytes():
+            pass
+    return "POST /api/chat/stream", response
+
+
+SCENARIOS = {
+    "posts": scenario_posts,
+    "posts_hydrated": scenario_posts_hydrated,
+    "notifications": scenario_notifications,
+    "unread_count": scenario_unread_count,
+    "dashboard_notifications": scenario_dashboard_notifications,
+    "popular_posts": scenario_popular_posts,
+    "like": scenario_like,
+    "chat": scenario_chat,
+    "chat_stream": scenario_chat_stream,
+}
+
+
+class Results:
+    def __init__(self):
+        self.latency = {}
+        self.errors = {}
+        self.status = {}
+
+    def record(self, endpoint, latency_ms, status):
+        self.latency.setdefault(endpoint, LatencyTracker(max_samples=1_000_000)).record(latency_ms)
+        self.status.setdefault(endpoint, {})
+        self.status[endpoint][status] = self.status[endpoint].get(status, 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed):
+        rows = {}
+        for endpoint, tracker in sorted(self.latency.items()):
+            rows[endpoint] = {
+                **tracker.summary(),
+                "errors": self.errors.get(endpoint, 0),
+                "status": {str(k): v for k, v in self.status[endpoint].items()},
+                "rps": round(tracker.count / elapsed, 2),
+            }
+        total = sum(tracker.count for tracker in self.latency.values())
+        return {"elapsed_s": round(elapsed, 2), "requests": total, "rps": round(total / elapsed, 2), "endpoints": rows}
+
+
+async def worker(index, client, args, weights, results, deadline, budget, recording):
+    rng = random.Random(args.seed * 1000 + index)
+    ctx = Context(args, rng)
+    names, values = zip(*weights.items())
+    while time.perf_counter() < deadline:
+        if budget is not None:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+        scenario = rng.choices(names, values)[0]
+        started = time.perf_counter()
+        try:
+            endpoint, response = await SCENARIOS[scenario](client, ctx)
+            status = response.status_code
+        except httpx.HTTPError as err:
+            endpoint, status = scenario, type(err).__name__
+        if recording[0]:
+            results.record(endpoint, (time.perf_counter() - started) * 1000, status)
+
+
+async def wait_ready(client, timeout):
+    """等待 RAG 載入完成（/readyz 回 200）"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(1)
+    return False
+
+
+async def fetch_post_ids(client):
+    response = await client.get("/api/posts", params={"limit": 100})
+    response.raise_for_status()
+    return [post["id"] for post in response.json().get("posts", [])]
+
+
+def parse_mix(value):
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {name: 0 for name in SCENARIOS}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"未知的情境 {name}，可用: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def print_report(summary):
+    print(f"\n共 {summary['requests']} 個請求，{summary['elapsed_s']} 秒，{summary['rps']} req/s")
+    header = f"{'端點':<36}{'次數':>8}{'錯誤':>7}{'req/s':>9}{'avg':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, row in summary["endpoints"].items():
+        print(f"{endpoint:<36}{row['count']:>8}{row['errors']:>7}{row['rps']:>9}"
+              f"{row['avg_ms']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+    print("（延遲單位: ms）")
+
+
+async def run(args):
+    weights = {name: weight for name, weight in parse_mix(args.mix).items() if weight > 0}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        if any(name.startswith("chat") for name in weights):
+            print("等待 AI 助理載入完成...")
+            if not await wait_ready(client, args.ready_timeout):
+                raise SystemExit("後端在時限內沒有 ready，請確認 bench_server.py 的輸出")
+        args.post_ids = await fetch_post_ids(client)
+        if not args.post_ids:
+            weights.pop("like", None)
+
+        results = Results()
+        recording = [args.warmup <= 0]
+        budget = [args.requests] if args.requests else None
+        started = time.perf_counter()
+        deadline = started + args.warmup + (args.duration if not args.requests else 10 ** 9)
+        tasks = [
+            asyncio.create_task(worker(index, client, args, weights, results, deadline, budget, recording))
+            for index in range(args.concurrency)
+        ]
+        if args.warmup > 0:
+            await asyncio.sleep(args.warmup)
+            recording[0] = True
+            print("暖機結束，開始記錄")
+        measured_from = time.perf_counter()
+        await asyncio.gather(*tasks)
+        return results.summary(time.perf_counter() - measured_from)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="後端壓力測試")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--concurrency", type=int, default=20, help="同時進行的虛擬使用者數")
+    parser.add_argument("--duration", type=float, default=30, help="測試秒數（不含暖機）")
+    parser.add_argument("--requests", type=int, default=0, help="改為固定請求數（設定後忽略 --duration）")
+    parser.add_argument("--warmup", type=float, default=5, help="暖機秒數，期間的請求不列入統計")
+    parser.add_argument("--mix", default="", help="情境權重，例如 posts=3,chat=1（預設混合所有端點）")
+    parser.add_argument("--max-user-id", type=int, default=200, help="隨機使用者 id 的上限（見 seed_bench_db.py 的輸出）")
+    parser.add_argument("--questions", default="data/iGrow_iCare.txt", help="聊天題目來源")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--chat-timeout", type=float, default=60)
+    parser.add_argument("--ready-timeout", type=float, default=180)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="把結果寫到指定的 JSON 檔")
+    args = parser.parse_args()
+    args.questions = load_questions(args.questions)
+
+    summary = asyncio.run(run(args))
+    summary["config"] = {
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "mix": parse_mix(args.mix),
+        "warmup_s": args.warmup,
+    }
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+建立壓測用的 MySQL 資料庫：匯入 server/workmate.sql 與各建表腳本，再產生假資料
+
+用法（在 backend 目錄下）:
+    python benchmarks/seed_bench_db.py --db-name workmate_bench --users 500 --posts 5000
+
+連線設定沿用 .env 的 DB_HOST / DB_USER / DB_PASSWORD；--db-name 指定的資料庫會先被刪除再重建
+"""
+import os
+import sys
+import random
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(BACKEND_DIR)
+
+SCHEMA_SCRIPTS = [
+    os.path.join(ROOT_DIR, "server", "workmate.sql"),
+    os.path.join(BACKEND_DIR, "create_likes_comments_tables.sql"),
+    os.path.join(BACKEND_DIR, "create_notifications_table.sql"),
+    os.path.join(BACKEND_DIR, "create_mood_points_tables.sql"),
+]
+
+DEPTS = ["製程整合", "設備工程", "IC 設計", "人力資源", "資訊技術", "品質管理", "財務"]
+PHRASES = [
+    "今天的教育訓練很有收穫", "有人知道年假怎麼申請嗎？", "推薦一個很棒的線上課程",
+    "午餐有什麼好吃的？", "專案終於結案了，感謝大家", "請問導師制度怎麼報名",
+    "週末的健行活動還有名額嗎", "新廠的通勤交通車時間表更新了", "分享一下最近讀的書",
+]
+NOTIFICATION_TYPES = ["info", "success", "warning", "error"]
+
+
+def iter_statements(path):
+    """逐句讀出 SQL 檔（以行尾的分號分句，略過 -- 註解）"""
+    buffer = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            stripped = line.strip()
+            if not buffer and (not stripped or stripped.startswith("--")):
+                continue
+            buffer.append(line)
+            if stripped.endswith(";"):
+                yield "".join(buffer).strip().rstrip(";")
+                buffer = []
+    if buffer and "".join(buffer).strip():
+        yield "".join(buffer).strip()
+
+
+def random_time(rng, now, days):
+    return now - timedelta(seconds=rng.randint(0, days * 86400))
+
+
+def insert_batches(conn, cursor, query, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        cursor.executemany(query, rows[start:start + batch_size])
+        conn.commit()
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    conn = mysql.connector.connect(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+    )
+    cursor = conn.cursor()
+    started = time.perf_counter()
+
+    print(f"重建資料庫 {args.db_name}...")
+    cursor.execute(f"DROP DATABASE IF EXISTS `{args.db_name}`")
+    cursor.execute(f"CREATE DATABASE `{args.db_name}` DEFAULT CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci")
+    cursor.execute(f"USE `{args.db_name}`")
+
+    for path in SCHEMA_SCRIPTS:
+        print(f"匯入 {os.path.relpath(path, ROOT_DIR)}")
+        for statement in iter_statements(path):
+            cursor.execute(statement)
+        conn.commit()
+
+    now = datetime.now().replace(microsecond=0)
+
+    print(f"產生 {args.users} 位使用者...")
+    users = [
+        (f"測試使用者 {i}", f"bench{i}@example.com", "bench", rng.choice(DEPTS), random_time(rng, now, 365))
+        for i in range(args.users)
+    ]
+    insert_batches(conn, cursor, """
+        INSERT INTO users (name, email, password_hash, dept, created_at) VALUES (%s, %s, %s, %s, %s)
+    """, users, args.batch_size)
+    cursor.execute("SELECT id FROM users")
+    user_ids = [row[0] for row in cursor.fetchall()]
+
+    print(f"產生 {args.posts} 篇貼文...")
+    posts = [
+        (rng.choice(user_ids), f"{rng.choice(PHRASES)} #{i}", random_time(rng, now, args.days))
+        for i in range(args.posts)
+    ]
+    insert_batches(conn, cursor, "INSERT INTO posts (author_id, content, created_at) VALUES (%s, %s, %s)",
+                   posts, args.batch_size)
+    cursor.execute("SELECT id FROM posts")
+    post_ids = [row[0] for row in cursor.fetchall()]
+
+    print(f"產生約 {args.likes} 個讚...")
+    like_pairs = {(rng.choice(post_ids), rng.choice(user_ids)) for _ in range(args.likes)}
+    likes = [(post_id, user_id, random_time(rng, now, args.days)) for post_id, user_id in like_pairs]
+    insert_batches(conn, cursor, "INSERT IGNORE INTO post_likes (post_id, user_id, created_at) VALUES (%s, %s, %s)",
+                   likes, args.batch_size)
+
+    print(f"產生 {args.comments} 則留言...")
+    comments = [
+        (rng.choice(post_ids), rng.choice(user_ids), rng.choice(PHRASES), random_time(rng, now, args.days))
+        for _ in range(args.comments)
+    ]
+    insert_batches(conn, cursor, """
+        INSERT INTO post_comments (post_id, user_id, content, created_at) VALUES (%s, %s, %s, %s)
+    """, comments, args.batch_size)
+
+    print("更新貼文的讚數與留言數...")
+    cursor.execute("""
+        UPDATE posts p
+        SET likes_count = (SELECT COUNT(*) FROM post_likes l WHERE l.post_id = p.id),
+            comments_count = (SELECT COUNT(*) FROM post_comments c WHERE c.post_id = p.id)
+    """)
+    conn.commit()
+
+    total_notifications = len(user_ids) * args.notifications_per_user
+    print(f"產生 {total_notifications} 則通知...")
+    notifications = [
+        (user_id, f"測試通知 {i}", rng.choice(PHRASES), rng.choice(NOTIFICATION_TYPES),
+         rng.random() < args.read_ratio, random_time(rng, now, args.days))
+        for user_id in user_ids
+        for i in range(args.notifications_per_user)
+    ]
+    insert_batches(conn, cursor, """
+        INSERT INTO notifications (user_id, title, message, type, is_read, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, notifications, args.batch_size)
+
+    cursor.close()
+    conn.close()
+    print(f"完成 ({time.perf_counter() - started:.1f} s)：使用者 id {min(user_ids)}~{max(user_ids)}，"
+          f"貼文 id {min(post_ids)}~{max(post_ids)}")
+    print(f"壓測時可加上: --max-user-id {max(user_ids)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="建立壓測用的 MySQL 資料庫與假資料")
+    parser.add_argument("--db-name", default="workmate_bench")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--likes", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--notifications-per-user", type=int, default=50)
+    parser.add_argument("--read-ratio", type=float, default=0.7, help="已讀通知的比例")
+    parser.add_argument("--days", type=int, default=90, help="資料時間分散在最近幾天內")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    load_dotenv()
+    if args.db_name in ("workmate", os.getenv("DB_NAME")):
+        sys.exit(f"拒絕覆寫 {args.db_name}：請指定專用的壓測資料庫名稱")
+    seed(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,25 @@
 import os
 import re
+import json
+import hashlib
+import argparse
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain.schema import Document
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
+from answer_cache import bump_index_version, normalize_question
+from keyword_index import KeywordIndex, KEYWORD_INDEX_FILE
+from faq_index import FaqIndex, FAQ_INDEX_FILE, split_qa
 
 load_dotenv()
 
 DATA_PATH = "data"
 DB_PATH = "chroma_db"
+MANIFEST_FILE = "manifest.json"
 
 def qa_splitter(documents):
     """
@@ -26,45 +36,292 @@ def qa_splitter(documents):
     return qa_docs
 
 
-def build_database():
+def qa_hash(content):
+    """以內容計算 Q&A 區塊的 ID，內容不變 ID 就不變"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def load_manifest(db_path=DB_PATH):
+    try:
+        with open(os.path.join(db_path, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"entries": {}}
+
+
+def save_manifest(manifest, db_path=DB_PATH):
+    os.makedirs(db_path, exist_ok=True)
+    tmp_path = os.path.join(db_path, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(db_path, MANIFEST_FILE))
+
+
+def _load_file(filepath):
+    """
+    在子行程中載入並切分單一檔案
+    只回傳可序列化的 (id, 內容, metadata)，避免在行程間傳遞整份文件
+    """
+    if filepath.endswith('.pdf'):
+        loader = PyPDFLoader(filepath)
+    else:
+        loader = TextLoader(filepath, encoding='utf-8')
+    chunks = []
+    for doc in qa_splitter(loader.load()):
+        # Chroma 的 metadata 只接受純量值
+        metadata = {k: v for k, v in doc.metadata.items() if isinstance(v, (str, int, float, bool))}
+        chunks.append((qa_hash(doc.page_content), doc.page_content, metadata))
+    return filepath, chunks
+
+
+def list_data_files(data_path=DATA_PATH):
+    return [
+        os.path.join(data_path, filename)
+        for filename in sorted(os.listdir(data_path))
+        if filename.endswith(('.pdf', '.txt'))
+    ]
+
+
+def iter_qa_chunks(files, workers, progress, failed=None):
+    """
+    以 process pool 平行載入檔案，逐一產出 (id, Document)
+    同時最多只有 workers * 2 個檔案在處理中，記憶體用量不隨檔案數成長
+    failed: 載入失敗的檔案路徑會加入這個 set
+    """
+    seen = set()
+    max_pending = max(1, workers * 2)
+    pending = {}  # future -> 檔案路徑
+    file_iter = iter(files)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def submit_next():
+            filepath = next(file_iter, None)
+            if filepath is not None:
+                pending[executor.submit(_load_file, filepath)] = filepath
+
+        for _ in range(max_pending):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                filepath = pending.pop(future)
+                submit_next()
+                try:
+                    filepath, chunks = future.result()
+                except Exception as err:
+                    print(f"載入文件失敗，略過 {filepath}: {err}")
+                    if failed is not None:
+                        failed.add(filepath)
+                    progress.file_done(0)
+                    continue
+                progress.file_done(len(chunks))
+                for doc_id, content, metadata in chunks:
+                    # 以內容雜湊去除重複的問答
+                    if doc_id in seen:
+                        continue
+                    seen.add(doc_id)
+                    yield doc_id, Document(page_content=content, metadata={**metadata, "qa_hash": doc_id})
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestProgress:
+    """匯入進度與吞吐量：docs/s、chunks/s、embedding 批次延遲"""
+
+    def __init__(self, total_files, report_interval=5.0):
+        self.total_files = total_files
+        self.report_interval = report_interval
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self.files = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.batches = 0
+        self.embed_seconds = 0.0
+        self.embed_max = 0.0
+
+    def file_done(self, chunk_count):
+        self.files += 1
+        self.chunks += chunk_count
+        self._maybe_report()
+
+    def batch_done(self, size, embed_seconds):
+        self.batches += 1
+        self.embedded += size
+        self.embed_seconds += embed_seconds
+        self.embed_max = max(self.embed_max, embed_seconds)
+        self._maybe_report()
+
+    def _maybe_report(self):
+        now = time.perf_counter()
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        avg_batch = self.embed_seconds / self.batches * 1000 if self.batches else 0.0
+        prefix = "匯入完成" if final else "匯入進度"
+        print(
+            f"{prefix}: 文件 {self.files}/{self.total_files} ({self.files / elapsed:.1f} docs/s), "
+            f"Q&A 區塊 {self.chunks} ({self.chunks / elapsed:.1f} chunks/s), "
+            f"已嵌入 {self.embedded}, 批次延遲 平均 {avg_batch:.0f} ms / 最大 {self.embed_max * 1000:.0f} ms"
+        )
+
+
+def iter_stored_chunks(db, page_size=1000):
+    """分頁讀出 Chroma 中所有 Q&A 區塊 (id, 內容, 來源)，不必一次載入整個資料庫"""
+    offset = 0
+    while True:
+        page = db._collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        for doc_id, content, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            yield doc_id, content, (metadata or {}).get("source")
+        offset += len(page["ids"])
+
+
+def build_faq_entries(db):
+    faq_entries = []
+    for doc_id, content, source in iter_stored_chunks(db):
+        qa = split_qa(content)
+        if qa is not None:
+            faq_entries.append({"id": doc_id, "question": qa[0], "answer": qa[1], "source": source})
+    return faq_entries
+
+
+def build_faq_index(embeddings, faq_entries, reuse_vectors=True):
+    """建立 FAQ 索引；問題向量與線上查詢一樣以正規化後的問題計算，未變更的題目沿用舊向量"""
+    vectors = {item["id"]: item["vector"] for item in FaqIndex.read(DB_PATH)} if reuse_vectors else {}
+    missing = [entry for entry in faq_entries if entry["id"] not in vectors]
+    if missing:
+        new_vectors = embeddings.embed_documents([normalize_question(entry["question"]) for entry in missing])
+        vectors.update(zip((entry["id"] for entry in missing), new_vectors))
+    FaqIndex(faq_entries, [vectors[entry["id"]] for entry in faq_entries]).save(DB_PATH)
+    print(f"FAQ 索引已更新：{len(faq_entries)} 題（新計算 {len(missing)} 個問題向量）")
+
+
+def build_database(rebuild=False, workers=None, batch_size=None):
     """
-    建立以 Q&A 問答對為單位的向量資料庫
+    建立以 Q&A 問答對為單位的向量資料庫（增量、串流）
+    - 檔案在 process pool 中載入與切分，Q&A 區塊逐一產出
+    - 每個 Q&A 以內容雜湊作為 ID，只對新增或修改的問答計算 embedding
+    - 以批次計算 embedding，每批完成就寫入 Chroma
+    - 已不存在的問答會從資料庫刪除，並在 chroma_db 旁記錄 manifest
+    - 匯入完成後從 Chroma 分頁讀回所有 Q&A，另建 BM25 關鍵字索引（chroma_db/keyword_index.json）供混合檢索
+    - 以及問題 -> 答案的 FAQ 索引（chroma_db/faq_index.json），高信心命中時不呼叫 LLM
     """
+    workers = workers or int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+    batch_size = batch_size or int(os.getenv("EMBED_BATCH_SIZE", 64))
     print("開始建立向量資料庫...")
 
-    documents = []
-    for filename in os.listdir(DATA_PATH):
-        filepath = os.path.join(DATA_PATH, filename)
-        if filename.endswith('.pdf'):
-            loader = PyPDFLoader(filepath)
-            documents.extend(loader.load())
-        elif filename.endswith('.txt'):
-            loader = TextLoader(filepath, encoding='utf-8')
-            documents.extend(loader.load())
-        if documents:
-            print(f"已成功載入文件: {filename}")
-
-    if not documents:
+    if rebuild and os.path.exists(DB_PATH):
+        print(f"完整重建：刪除既有的 '{DB_PATH}'")
+        shutil.rmtree(DB_PATH)
+
+    files = list_data_files()
+    if not files:
         print(f"在 '{DATA_PATH}' 資料夾中找不到任何可讀取的文件。")
         return
 
-    # 用自製的 Q&A Splitter
-    chunked_documents = qa_splitter(documents)
-    print(f"文件已成功切分為 {len(chunked_documents)} 個 Q&A 區塊。")
-
     print("正在初始化 Hugging Face Embedding Model...")
     model_name = "sentence-transformers/all-MiniLM-L6-v2"
     embeddings = HuggingFaceEmbeddings(model_name=model_name)
     print("模型初始化成功。")
 
-    print("正在生成嵌入向量並建立資料庫...")
-    db = Chroma.from_documents(
-        documents=chunked_documents,
-        embedding=embeddings,
-        persist_directory=DB_PATH
-    )
-    print(f"向量資料庫已成功建立！儲存路徑: '{DB_PATH}'")
+    db = Chroma(persist_directory=DB_PATH, embedding_function=embeddings)
+
+    # 以資料庫中實際存在的 ID 為準，舊版以隨機 ID 寫入的向量也會一併清除
+    existing_ids = set(db.get(include=[])["ids"])
+    previous = load_manifest()
+    previous_model = previous.get("embedding_model")
+    model_changed = bool(previous_model) and previous_model != model_name
+    if model_changed:
+        # 換了 embedding 模型，舊向量全部作廢
+        print(f"Embedding 模型由 {previous_model} 變更為 {model_name}，重新計算所有向量。")
+        if existing_ids:
+            db.delete(ids=list(existing_ids))
+        existing_ids = set()
+
+    print(f"以 {workers} 個行程載入 {len(files)} 個文件，每批嵌入 {batch_size} 個 Q&A 區塊...")
+    progress = IngestProgress(len(files))
+    # 匯入期間只保留 manifest 需要的 ID、來源與問題，不保留 Q&A 全文
+    entries = {}
+    failed = set()
+
+    def new_chunks():
+        for doc_id, doc in iter_qa_chunks(files, workers, progress, failed):
+            entries[doc_id] = {
+                "source": doc.metadata.get("source"),
+                "question": doc.page_content.split("\n", 1)[0],
+            }
+            if doc_id not in existing_ids:
+                yield doc_id, doc
+
+    added = 0
+    for batch in batched(new_chunks(), batch_size):
+        ids = [doc_id for doc_id, _ in batch]
+        texts = [doc.page_content for _, doc in batch]
+        started = time.perf_counter()
+        vectors = embeddings.embed_documents(texts)
+        progress.batch_done(len(batch), time.perf_counter() - started)
+        db._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=texts,
+            metadatas=[doc.metadata for _, doc in batch],
+        )
+        added += len(batch)
+    progress.report(final=True)
+
+    # 載入失敗的檔案（例如 PDF 暫時無法解析）保留原本的 Q&A，不當成已刪除
+    kept = 0
+    if failed:
+        for doc_id, entry in previous.get("entries", {}).items():
+            if entry.get("source") in failed and doc_id in existing_ids and doc_id not in entries:
+                entries[doc_id] = entry
+                kept += 1
+        print(f"{len(failed)} 個文件載入失敗，保留其原有的 {kept} 個 Q&A 區塊，下次執行時再更新。")
+
+    to_delete = [doc_id for doc_id in existing_ids if doc_id not in entries]
+    if to_delete:
+        db.delete(ids=to_delete)
+    print(f"新增/修改 {added} 個、刪除 {len(to_delete)} 個、未變更 {len(entries) - added - kept} 個 Q&A 區塊。")
+
+    save_manifest({"embedding_model": model_name, "entries": entries})
+
+    # 索引以 Chroma 的實際內容建立（含載入失敗而保留下來的 Q&A）
+    if added or to_delete or not os.path.exists(os.path.join(DB_PATH, KEYWORD_INDEX_FILE)):
+        keyword_index = KeywordIndex.build(iter_stored_chunks(db))
+        keyword_index.save(DB_PATH)
+        print(f"關鍵字索引已更新：{len(keyword_index)} 個 Q&A 區塊")
+        del keyword_index
+
+    if added or to_delete or model_changed or not os.path.exists(os.path.join(DB_PATH, FAQ_INDEX_FILE)):
+        build_faq_index(embeddings, build_faq_entries(db), reuse_vectors=not model_changed)
+
+    if added or to_delete:
+        # 通知後端的回答快取：知識庫內容已變更
+        bump_index_version(DB_PATH)
+        print(f"向量資料庫已成功更新！儲存路徑: '{DB_PATH}'")
+    else:
+        print("知識庫內容沒有變更，不需要更新向量資料庫。")
 
 
 if __name__ == "__main__":
-    build_database()
+    parser = argparse.ArgumentParser(description="建立 / 增量更新 Q&A 向量資料庫")
+    parser.add_argument("--rebuild", action="store_true", help="刪除既有資料庫後完整重建")
+    parser.add_argument("--workers", type=int, default=None, help="載入文件的行程數（預設 INGEST_WORKERS 或 CPU 數）")
+    parser.add_argument("--batch-size", type=int, default=None, help="每批 embedding 的 Q&A 數（預設 EMBED_BATCH_SIZE 或 64）")
+    args = parser.parse_args()
+    build_database(rebuild=args.rebuild, workers=args.workers, batch_size=args.batch_size)
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict, defaultdict
+
+
+def _namespace(key):
+    parts = key.split(":")
+    return parts[1] if len(parts) > 1 else key
+
+
+class CacheStats:
+    """以 key 的第二段（例如 dashboard:popular -> popular）分組統計命中率"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+
+    def hit(self, key):
+        with self._lock:
+            self._hits[_namespace(key)] += 1
+
+    def miss(self, key):
+        with self._lock:
+            self._misses[_namespace(key)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name in set(self._hits) | set(self._misses):
+                hits, misses = self._hits[name], self._misses[name]
+                result[name] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                }
+            return result
+
+
+class LocalCache:
+    """行程內的 TTL + LRU 快取"""
+
+    backend = "local"
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats.hit(key)
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        self.stats.miss(key)
+        return None
+
+    async def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """多個 worker 共用的快取（需要安裝 redis 套件並設定 CACHE_REDIS_URL）"""
+
+    backend = "redis"
+
+    def __init__(self, url, prefix="workmate:"):
+        import redis.asyncio as redis
+        self._client = redis.from_url(url)
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    async def get(self, key):
+        raw = await self._client.get(self.prefix + key)
+        if raw is None:
+            self.stats.miss(key)
+            return None
+        self.stats.hit(key)
+        return json.loads(raw)
+
+    async def set(self, key, value, ttl):
+        await self._client.set(self.prefix + key, json.dumps(value, ensure_ascii=False, default=str), ex=max(1, int(ttl)))
+
+    async def delete(self, key):
+        await self._client.delete(self.prefix + key)
+
+    async def delete_prefix(self, prefix):
+        keys = [key async for key in self._client.scan_iter(match=self.prefix + prefix + "*")]
+        if keys:
+            await self._client.delete(*keys)
+
+    def size(self):
+        return None
+
+
+def create_cache():
+    url = os.getenv("CACHE_REDIS_URL")
+    if url:
+        try:
+            return RedisCache(url)
+        except ImportError:
+            print("未安裝 redis 套件，改用行程內快取")
+    return LocalCache(max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 10000)))
+
+
+cache = create_cache()
@@ -30,4 +30,8 @@ CREATE TABLE `post_comments` (
 -- 為 posts 表添加一些輔助欄位來快速獲取統計資訊（可選）
 ALTER TABLE `posts`
 ADD COLUMN `likes_count` int(11) DEFAULT 0,
-ADD COLUMN `comments_count` int(11) DEFAULT 0;
\ No newline at end of file
+ADD COLUMN `comments_count` int(11) DEFAULT 0;
+
+-- 社群動態以 (created_at, id) 做游標分頁，需要對應的複合索引
+ALTER TABLE `posts`
+ADD INDEX `idx_posts_created_at_id` (`created_at`, `id`);
@@ -0,0 +1,26 @@
+-- 創建心情紀錄表：每位使用者每天一筆
+CREATE TABLE IF NOT EXISTS `mood_entries` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `user_id` int(10) UNSIGNED NOT NULL,
+  `mood_score` tinyint(4) NOT NULL,
+  `entry_date` date NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT current_timestamp(),
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `unique_user_entry_date` (`user_id`, `entry_date`),
+  CONSTRAINT `mood_entries_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- 創建積分表
+CREATE TABLE IF NOT EXISTS `user_points` (
+  `user_id` int(10) UNSIGNED NOT NULL,
+  `points` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`user_id`),
+  CONSTRAINT `user_points_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+-- 既有資料庫：聊天時的心情紀錄以 INSERT IGNORE 判斷是否為當天第一筆，需要這個唯一索引
+-- （CREATE TABLE IF NOT EXISTS 不會替已存在的表補上；後端啟動時會檢查，缺少時改用較慢的鎖定查詢）
+-- 先清掉同一天的重複紀錄（保留最新一筆）再加上索引：
+-- DELETE m1 FROM `mood_entries` m1 JOIN `mood_entries` m2
+--   ON m1.user_id = m2.user_id AND m1.entry_date = m2.entry_date AND m1.id < m2.id;
+-- ALTER TABLE `mood_entries` ADD UNIQUE KEY `unique_user_entry_date` (`user_id`, `entry_date`);
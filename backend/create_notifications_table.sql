@@ -11,8 +11,31 @@ CREATE TABLE IF NOT EXISTS notifications (
 
     INDEX idx_user_id (user_id),
     INDEX idx_is_read (is_read),
-    INDEX idx_created_at (created_at)
+    INDEX idx_created_at (created_at),
+    INDEX idx_user_read_created (user_id, is_read, created_at),
+    INDEX idx_user_created_id (user_id, created_at, id)
 );
 
+-- 已讀且超過保留期限的通知由後端排程搬到歸檔表，讓 notifications 保持精簡
+CREATE TABLE IF NOT EXISTS notifications_archive (
+    id INT PRIMARY KEY,
+    user_id INT NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    message TEXT NOT NULL,
+    type ENUM('info', 'success', 'warning', 'error') DEFAULT 'info',
+    is_read BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP NULL,
+    updated_at TIMESTAMP NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    INDEX idx_user_created (user_id, created_at)
+);
+
+-- 既有資料庫升級時補上分頁 / 未讀查詢用的複合索引
+-- idx_user_created_id：預設的「全部通知」分頁（ORDER BY created_at DESC, id DESC）不必排序
+-- idx_user_read_created：只看未讀（unread_only=true）
+-- ALTER TABLE notifications ADD INDEX idx_user_created_id (user_id, created_at, id);
+-- ALTER TABLE notifications ADD INDEX idx_user_read_created (user_id, is_read, created_at);
+
 -- 如果需要外鍵約束，可以取消註解以下行
 -- ALTER TABLE notifications ADD CONSTRAINT fk_notifications_user_id FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
\ No newline at end of file
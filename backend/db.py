@@ -0,0 +1,205 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import pooling
+from mysql.connector.constants import ClientFlag
+from dotenv import load_dotenv
+
+from metrics import db_query_duration, db_query_errors
+
+load_dotenv()
+
+
+class DatabaseUnavailable(Exception):
+    """連線池無法在等待時間內提供連線，或資料庫無法連線"""
+
+
+class DatabasePool:
+    """
+    有上限的 MySQL 連線池
+    - 啟動時建立、關閉時釋放（由 FastAPI lifespan 管理）
+    - 所有阻塞的 cursor 操作都丟到 thread pool 執行，不佔用 event loop
+    - 連線用完時最多等待 wait_timeout 秒，超過就丟出 DatabaseUnavailable
+    """
+
+    def __init__(self, config, pool_size=10, wait_timeout=5.0, name="workmate"):
+        # mysql-connector 的連線池上限是 32
+        self.config = config
+        self.pool_size = max(1, min(int(pool_size), 32))
+        self.wait_timeout = float(wait_timeout)
+        self.name = name
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._in_use = 0
+        self._acquired_total = 0
+        self._timeouts = 0
+        self._errors = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._opened = 0
+
+    # --- 生命週期 ---
+    def open(self):
+        with self._open_lock:
+            if self._pool is not None:
+                return
+            self._pool = pooling.MySQLConnectionPool(
+                pool_name=self.name,
+                pool_size=self.pool_size,
+                pool_reset_session=True,
+                **self.config,
+            )
+            self._opened += 1
+        print(f"資料庫連線池已建立 (size={self.pool_size}, wait_timeout={self.wait_timeout}s)")
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        try:
+            pool._remove_connections()
+        except Exception as err:
+            print(f"關閉資料庫連線池時發生錯誤: {err}")
+        print("資料庫連線池已關閉")
+
+    # --- 取得 / 歸還連線 ---
+    def _acquire(self):
+        if self._pool is None:
+            # 尚未透過 lifespan 開啟（或啟動時資料庫尚未就緒）才延遲建立
+            try:
+                self.open()
+            except mysql.connector.Error as err:
+                with self._lock:
+                    self._errors += 1
+                print(f"資料庫連線失敗: {err}")
+                raise DatabaseUnavailable(str(err)) from err
+
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise DatabaseUnavailable("等待資料庫連線逾時")
+        waited = time.perf_counter() - started
+
+        try:
+            conn = self._pool.get_connection()
+        except mysql.connector.Error as err:
+            self._slots.release()
+            with self._lock:
+                self._errors += 1
+            print(f"資料庫連線失敗: {err}")
+            raise DatabaseUnavailable(str(err)) from err
+
+        with self._lock:
+            self._in_use += 1
+            self._acquired_total += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def _release(self, conn):
+        try:
+            # 對 pooled connection 而言 close() 是歸還連線池
+            conn.close()
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    # --- 同步執行（在 worker thread 中呼叫）---
+    def run_sync(self, func, *args, commit=False, name=None):
+        """
+        以 dictionary cursor 執行 func(cursor, *args)
+        commit=True 時成功後提交，失敗則 rollback
+        name: 指標上的查詢名稱，預設為 func 的名稱（去掉底線）
+        """
+        name = name or func.__name__.strip("_")
+        started = time.perf_counter()
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    result = func(cursor, *args)
+                    if commit:
+                        conn.commit()
+                    return result
+                except Exception:
+                    if commit:
+                        conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except Exception:
+            db_query_errors.labels(name).inc()
+            raise
+        finally:
+            db_query_duration.labels(name).observe(time.perf_counter() - started)
+
+    # --- 非同步介面（給 async handler 使用）---
+    async def run(self, func, *args, commit=False, name=None):
+        return await asyncio.to_thread(self.run_sync, func, *args, commit=commit, name=name)
+
+    async def fetch_one(self, query, params=(), name="fetch_one"):
+        def _fetch(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchone()
+        return await self.run(_fetch, name=name)
+
+    async def fetch_all(self, query, params=(), name="fetch_all"):
+        def _fetch(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        return await self.run(_fetch, name=name)
+
+    async def execute(self, query, params=(), name="execute"):
+        """執行單一寫入語句並提交，回傳 (rowcount, lastrowid)"""
+        def _execute(cursor):
+            cursor.execute(query, params)
+            return cursor.rowcount, cursor.lastrowid
+        return await self.run(_execute, commit=True, name=name)
+
+    # --- 監控 ---
+    def stats(self):
+        with self._lock:
+            acquired = self._acquired_total
+            return {
+                "pool_size": self.pool_size,
+                "in_use": self._in_use,
+                "idle": self.pool_size - self._in_use if self._pool is not None else 0,
+                "acquired_total": acquired,
+                "opened": self._opened,
+                "timeouts": self._timeouts,
+                "errors": self._errors,
+                "wait_avg_ms": round(self._wait_total / acquired * 1000, 3) if acquired else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+
+DB_CONFIG = {
+    'host': os.getenv("DB_HOST"),
+    'user': os.getenv("DB_USER"),
+    'password': os.getenv("DB_PASSWORD"),
+    'database': os.getenv("DB_NAME"),
+    # UPDATE 的 rowcount 回傳符合條件的筆數（而非實際變更的筆數），可直接判斷資料是否存在
+    'client_flags': [ClientFlag.FOUND_ROWS],
+}
+
+db_pool = DatabasePool(
+    DB_CONFIG,
+    pool_size=int(os.getenv("DB_POOL_SIZE", 10)),
+    wait_timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)),
+)
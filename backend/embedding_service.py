@@ -0,0 +1,136 @@
+import time
+import queue
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from answer_cache import normalize_question
+from metrics import LatencyTracker
+
+
+class EmbeddingService(Embeddings):
+    """
+    問題向量的計算服務，可直接當作 Chroma 的 embedding_function
+    - 模型只在一條專用執行緒上執行，不佔用 event loop 與預設 thread pool
+    - batch_window_ms 內同時到達的問題合併成一批（最多 max_batch 筆）一次計算
+    - 正規化後相同的問題共用結果：已算過的從 LRU 取，正在算的等同一個 Future
+    建庫時的 embed_documents 不走批次，直接呼叫模型
+    """
+
+    def __init__(self, model, max_batch=32, batch_window_ms=5, memo_size=2048):
+        self.model = model
+        self.max_batch = max_batch
+        self.batch_window = batch_window_ms / 1000
+        self.memo_size = memo_size
+        self._memo = OrderedDict()  # normalized question -> vector
+        self._inflight = {}  # normalized question -> Future
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.queue_wait = LatencyTracker()
+        self.batch_time = LatencyTracker()
+        self.batches = 0
+        self.batched_items = 0
+        self.largest_batch = 0
+        self.memo_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._worker, name="embedding-service", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """送出一個問題，回傳 concurrent.futures.Future（結果為向量）"""
+        key = normalize_question(text)
+        with self._lock:
+            vector = self._memo.get(key)
+            if vector is not None:
+                self._memo.move_to_end(key)
+                self.memo_hits += 1
+                future = Future()
+                future.set_result(vector)
+                return future
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            self.misses += 1
+            future = Future()
+            self._inflight[key] = future
+        self._queue.put((key, future, time.perf_counter()))
+        return future
+
+    def embed_query(self, text):
+        return self.submit(text).result()
+
+    async def aembed_query(self, text):
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                # 視窗結束後仍把已經排隊的取完，不讓它們多等一輪
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for _, _, queued_at in batch:
+                self.queue_wait.record((started - queued_at) * 1000)
+
+            try:
+                vectors = self.model.embed_documents([key for key, _, _ in batch])
+            except Exception as err:
+                print(f"計算 embedding 失敗: {err}")
+                with self._lock:
+                    self.errors += 1
+                    for key, _, _ in batch:
+                        self._inflight.pop(key, None)
+                for _, future, _ in batch:
+                    future.set_exception(err)
+                continue
+
+            self.batch_time.record((time.perf_counter() - started) * 1000)
+            with self._lock:
+                self.batches += 1
+                self.batched_items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                for (key, _, _), vector in zip(batch, vectors):
+                    self._memo[key] = vector
+                    self._memo.move_to_end(key)
+                    self._inflight.pop(key, None)
+                while len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self):
+        with self._lock:
+            requests = self.memo_hits + self.coalesced + self.misses
+            return {
+                "requests": requests,
+                "memo_hits": self.memo_hits,
+                "coalesced": self.coalesced,
+                "memo_hit_rate": round((self.memo_hits + self.coalesced) / requests, 4) if requests else 0.0,
+                "memo_size": len(self._memo),
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "avg_batch_size": round(self.batched_items / self.batches, 2) if self.batches else None,
+                "largest_batch": self.largest_batch,
+                "errors": self.errors,
+                "queue_wait": self.queue_wait.summary(),
+                "batch_time": self.batch_time.summary(),
+            }
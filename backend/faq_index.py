@@ -0,0 +1,126 @@
+import os
+import re
+import json
+import time
+import threading
+
+import numpy as np
+
+from answer_cache import normalize_question
+
+FAQ_INDEX_FILE = "faq_index.json"
+
+_QA = re.compile(r"Q[:：]\s*(.*?)\s*\n\s*A[:：]\s*(.*)", re.S)
+
+# 直接回覆知識庫答案時，以小黑的口吻包一層
+PERSONA_PREFIX = "這題我知道 (๑•̀ㅂ•́)و✧\n\n"
+PERSONA_SUFFIX = "\n\n還有其他想問的，隨時找我哦 🐾"
+
+
+def split_qa(content):
+    """把 qa_splitter 產生的「Q: ...\\nA: ...」拆成 (問題, 答案)，格式不符時回傳 None"""
+    match = _QA.match(content.strip())
+    if match is None:
+        return None
+    question, answer = match.group(1).strip(), match.group(2).strip()
+    return (question, answer) if question and answer else None
+
+
+class FaqIndex:
+    """
+    知識庫問題 -> 答案的對照表，問題與知識庫中的某一題幾乎相同時直接回覆答案，不呼叫 LLM
+    - 正規化後完全相同：直接命中
+    - 否則以問題向量與各題的 cosine similarity 比對，超過 threshold 才命中
+    由 build_database.py 建立並存成 chroma_db/faq_index.json
+    """
+
+    def __init__(self, entries, vectors, threshold=0.92):
+        self.entries = entries  # [{"id", "question", "answer", "source"}]
+        self.threshold = threshold
+        if entries:
+            matrix = np.asarray(vectors, dtype=np.float32).reshape(len(entries), -1)
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self._matrix = matrix / np.where(norms == 0, 1, norms)
+        self._exact = {normalize_question(entry["question"]): i for i, entry in enumerate(entries)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def match(self, question, vector=None):
+        """回傳 (entry, 分數) 或 (None, 最高分)"""
+        position = self._exact.get(normalize_question(question))
+        if position is not None:
+            with self._lock:
+                self.hits += 1
+                self.exact_hits += 1
+            return self.entries[position], 1.0
+
+        best_score = 0.0
+        if vector is not None and len(self.entries):
+            vector = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            scores = self._matrix @ (vector / norm if norm else vector)
+            position = int(np.argmax(scores))
+            best_score = float(scores[position])
+            if best_score >= self.threshold:
+                with self._lock:
+                    self.hits += 1
+                return self.entries[position], best_score
+
+        with self._lock:
+            self.misses += 1
+        return None, best_score
+
+    def save(self, db_path):
+        os.makedirs(db_path, exist_ok=True)
+        path = os.path.join(db_path, FAQ_INDEX_FILE)
+        data = [
+            {**entry, "vector": [round(float(x), 6) for x in vector]}
+            for entry, vector in zip(self.entries, self._matrix)
+        ]
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def read(db_path):
+        """讀出已存的 [entry + vector]，建庫時用來沿用未變更題目的向量"""
+        try:
+            with open(os.path.join(db_path, FAQ_INDEX_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    @classmethod
+    def load(cls, db_path, threshold=0.92):
+        started = time.perf_counter()
+        data = cls.read(db_path)
+        if not data:
+            print("找不到 FAQ 索引，所有問題都交給 LLM 回答（請重新執行 build_database.py）")
+            return None
+        vectors = [item.pop("vector") for item in data]
+        index = cls(data, vectors, threshold=threshold)
+        print(f"已載入 FAQ 索引：{len(index)} 題 ({(time.perf_counter() - started) * 1000:.0f} ms)")
+        return index
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "exact_hits": self.exact_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def wrap_answer(answer, persona=True):
+    return PERSONA_PREFIX + answer + PERSONA_SUFFIX if persona else answer
@@ -0,0 +1,102 @@
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+
+
+async def run_periodically(name, interval, func, *args):
+    """
+    每 interval 秒執行一次 async func(*args)，直到被取消
+    單次失敗只記錄錯誤，不中斷排程
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await func(*args)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            print(f"排程工作 {name} 執行失敗: {err}")
+
+
+class PeriodicJobs:
+    """管理 lifespan 期間的背景排程工作"""
+
+    def __init__(self):
+        self._tasks = []
+
+    def start(self, name, interval, func, *args):
+        if interval <= 0:
+            print(f"排程工作 {name} 已停用")
+            return
+        self._tasks.append(asyncio.create_task(run_periodically(name, interval, func, *args)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class JobRegistry:
+    """
+    記錄一次性背景工作（例如大量通知發送）的狀態與進度
+    只保留最近 max_jobs 筆
+    """
+
+    def __init__(self, max_jobs=100):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._tasks = set()
+
+    def submit(self, kind, func, *args, total=None):
+        """
+        建立工作並在背景執行 async func(job, *args)
+        func 可以更新 job["processed"] / job["total"] 回報進度
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "total": total,
+            "processed": 0,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self._jobs[job_id] = job
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+        task = asyncio.create_task(self._run(job, func, *args))
+        # 保留 task 的參照，避免執行中被回收
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job, func, *args):
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        try:
+            await func(job, *args)
+            job["status"] = "completed"
+        except Exception as err:
+            job["status"] = "failed"
+            job["error"] = str(err)
+            print(f"背景工作 {job['kind']} ({job['id']}) 失敗: {err}")
+        finally:
+            job["finished_at"] = time.time()
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        result = dict(job)
+        if job["total"]:
+            result["progress"] = round(job["processed"] / job["total"], 4)
+        return result
+
+
+job_registry = JobRegistry()
@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import math
+import time
+from collections import Counter, defaultdict
+
+KEYWORD_INDEX_FILE = "keyword_index.json"
+
+# 英數詞（含 15%、NEO-101、3.5 這類寫法）與連續的中日韓文字
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*%?|[\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text):
+    """
+    英數詞整個保留；中文沒有空白斷詞，以相鄰兩字（bigram）為單位
+    例如「員工購股」-> 員工 / 工購 / 購股，單一個中文字則保留原字
+    """
+    tokens = []
+    for match in _TOKEN.findall(text.lower()):
+        if match[0].isascii():
+            tokens.append(match)
+        elif len(match) == 1:
+            tokens.append(match)
+        else:
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+class KeywordIndex:
+    """
+    Q&A 區塊的 BM25 倒排索引，補足向量檢索抓不到的精確詞（購股、15%、課程代碼…）
+    由 build_database.py 建立並存成 chroma_db/keyword_index.json
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.contents = []
+        self.sources = []
+        self.doc_lengths = []
+        self.postings = {}  # term -> [[doc index, term frequency]]
+        self.avg_length = 0.0
+        self._idf = {}
+
+    @classmethod
+    def build(cls, docs, **kwargs):
+        """docs: [(id, 內容, 來源)]"""
+        index = cls(**kwargs)
+        postings = defaultdict(list)
+        for position, (doc_id, content, source) in enumerate(docs):
+            counts = Counter(tokenize(content))
+            index.ids.append(doc_id)
+            index.contents.append(content)
+            index.sources.append(source)
+            index.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append([position, tf])
+        index.postings = dict(postings)
+        index._prepare()
+        return index
+
+    def _prepare(self):
+        count = len(self.ids)
+        self.avg_length = sum(self.doc_lengths) / count if count else 0.0
+        self._idf = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=10):
+        """回傳 [(doc index, BM25 分數)]，由高到低"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for position, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / self.avg_length)
+                scores[position] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, db_path):
+        os.makedirs(db_path, exist_ok=True)
+        path = os.path.join(db_path, KEYWORD_INDEX_FILE)
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "contents": self.contents,
+            "sources": self.sources,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, db_path):
+        """載入建好的索引；檔案不存在（尚未以新版 build_database.py 建庫）時回傳 None"""
+        started = time.perf_counter()
+        try:
+            with open(os.path.join(db_path, KEYWORD_INDEX_FILE), encoding="utf-8") as f:
+                data = json.load(f)
+        except OSError:
+            print("找不到關鍵字索引，只使用向量檢索（請重新執行 build_database.py）")
+            return None
+        index = cls(k1=data["k1"], b=data["b"])
+        index.ids = data["ids"]
+        index.contents = data["contents"]
+        index.sources = data["sources"]
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = data["postings"]
+        index._prepare()
+        print(f"已載入關鍵字索引：{len(index)} 個 Q&A 區塊、{len(index.postings)} 個詞 "
+              f"({(time.perf_counter() - started) * 1000:.0f} ms)")
+        return index
@@ -0,0 +1,271 @@
+import os
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+
+from metrics import registry
+
+# 上游暫時性的錯誤（以類別名稱判斷，不必直接依賴 openai / httpx）
+TRANSIENT_ERRORS = {
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "ServiceUnavailableError", "ConnectError", "ReadTimeout", "RemoteProtocolError",
+}
+
+
+def is_transient(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+class LlmGateError(Exception):
+    """LLM 無法處理這個請求；status_code 為建議回給前端的 HTTP 狀態碼"""
+
+    status_code = 503
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LlmOverloaded(LlmGateError):
+    """排隊的請求已達上限，或等待名額逾時"""
+
+    status_code = 429
+
+
+class LlmCircuitOpen(LlmGateError):
+    """近期連續失敗，暫停呼叫上游"""
+
+
+class LlmUnavailable(LlmGateError):
+    """逾時或重試後仍失敗"""
+
+
+class CircuitBreaker:
+    """
+    連續失敗 failure_threshold 次就打開 cooldown 秒，期間直接拒絕
+    冷卻後放行一個試探請求（half-open），成功才恢復
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.opened_total = 0
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def check(self):
+        """熔斷中丟出 LlmCircuitOpen；回傳 True 表示這個請求是 half-open 的試探請求"""
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            retry_after = max(1, int(self.cooldown - (time.monotonic() - self.opened_at)))
+            raise LlmCircuitOpen("AI 助理的上游服務暫時無法使用", retry_after=retry_after)
+        if state == "half_open":
+            self._probing = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.opened_total += 1
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """試探請求沒有得到結果（被拒絕、取消或不可重試的錯誤）時，讓下一個請求繼續試探"""
+        self._probing = False
+
+
+class LlmGate:
+    """
+    LLM 呼叫的閘門，避免上游變慢時拖垮整個 API
+    - 最多 max_concurrency 個同時呼叫，另外最多 max_queue 個排隊，其餘立即以 429 拒絕
+    - 排隊超過 queue_timeout 秒也以 429 拒絕
+    - 每個請求總共最多 timeout 秒（含重試）
+    - 暫時性錯誤以 jitter 指數退避重試，連續失敗由 CircuitBreaker 熔斷
+    """
+
+    def __init__(self, max_concurrency=8, max_queue=32, queue_timeout=5.0, timeout=30.0,
+                 retries=2, backoff=0.5, breaker=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", 32)),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", 5)),
+            timeout=float(os.getenv("LLM_TIMEOUT", 30)),
+            retries=int(os.getenv("LLM_RETRIES", 2)),
+            backoff=float(os.getenv("LLM_RETRY_BACKOFF", 0.5)),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", 5)),
+                cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", 30)),
+            ),
+        )
+
+    @asynccontextmanager
+    async def slot(self):
+        probing = self.breaker.check()
+        try:
+            if self.waiting >= self.max_queue and self._semaphore.locked():
+                self.rejected += 1
+                raise LlmOverloaded("AI 助理目前忙碌中，請稍後再試", retry_after=1)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise LlmOverloaded("AI 助理目前忙碌中，請稍後再試", retry_after=1) from None
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+                self._semaphore.release()
+        finally:
+            if probing and self.breaker.state == "half_open":
+                self.breaker.release_probe()
+
+    def _delay(self, attempt):
+        # full jitter：0 ~ backoff * 2^attempt
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError
+        return remaining
+
+    def _on_error(self, error, attempt, deadline):
+        """
+        回傳重試前要等待的秒數；不該重試時丟出例外
+        熔斷只計算最終失敗的請求，重試中的暫時性錯誤不計入
+        """
+        if isinstance(error, asyncio.TimeoutError):
+            self.timeouts += 1
+            self.breaker.failure()
+            raise LlmUnavailable("AI 助理回應逾時，請稍後再試") from error
+        if not is_transient(error):
+            raise error
+        delay = self._delay(attempt)
+        if attempt >= self.retries or self.breaker.state != "closed" or time.monotonic() + delay >= deadline:
+            self.failed += 1
+            self.breaker.failure()
+            raise LlmUnavailable("AI 助理目前無法使用，請稍後再試") from error
+        self.retried += 1
+        return delay
+
+    async def invoke(self, run):
+        """run: 不帶參數、回傳 coroutine 的函式；每次重試都重新呼叫"""
+        async with self.slot():
+            deadline = time.monotonic() + self.timeout
+            attempt = 0
+            while True:
+                try:
+                    # 先確認還有剩餘時間再建立 coroutine，逾時時才不會留下沒被 await 的 coroutine
+                    remaining = self._remaining(deadline)
+                    result = await asyncio.wait_for(run(), remaining)
+                except Exception as error:
+                    await asyncio.sleep(self._on_error(error, attempt, deadline))
+                    attempt += 1
+                    continue
+                self.breaker.success()
+                return result
+
+    async def stream(self, run):
+        """
+        run: 不帶參數、回傳 async iterator 的函式
+        只在還沒送出任何片段前重試，已經送出的內容不會重複
+        """
+        async with self.slot():
+            deadline = time.monotonic() + self.timeout
+            attempt = 0
+            while True:
+                iterator = run().__aiter__()
+                sent = False
+                delay = None
+                try:
+                    while True:
+                        try:
+                            remaining = self._remaining(deadline)
+                            chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                        except StopAsyncIteration:
+                            break
+                        sent = True
+                        yield chunk
+                except Exception as error:
+                    if sent and not isinstance(error, asyncio.TimeoutError):
+                        if is_transient(error):
+                            self.breaker.failure()
+                            self.failed += 1
+                            raise LlmUnavailable("AI 助理回應中斷，請稍後再試") from error
+                        raise
+                    delay = self._on_error(error, attempt, deadline)
+                finally:
+                    if hasattr(iterator, "aclose"):
+                        await iterator.aclose()
+                if delay is None:
+                    self.breaker.success()
+                    return
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened_total,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+llm_gate = LlmGate.from_env()
+
+registry.gauge("llm_gate_active", "LLM calls in progress", lambda: llm_gate.active)
+registry.gauge("llm_gate_waiting", "Requests waiting for an LLM slot", lambda: llm_gate.waiting)
+registry.gauge("llm_gate_rejected_total", "Requests rejected because the LLM queue was full",
+               lambda: llm_gate.rejected, kind="counter")
+registry.gauge("llm_gate_timeouts_total", "LLM requests that hit the per-request timeout",
+               lambda: llm_gate.timeouts, kind="counter")
+registry.gauge("llm_gate_retries_total", "LLM retries after transient errors",
+               lambda: llm_gate.retried, kind="counter")
+registry.gauge("llm_circuit_open", "1 while the LLM circuit breaker is open",
+               lambda: int(llm_gate.breaker.state != "closed"))
@@ -1,24 +1,73 @@
 import os
+import json
+import asyncio
+import time
 import uvicorn
 import mysql.connector
-from datetime import date
+from contextlib import asynccontextmanager, aclosing
+from datetime import date, timedelta
 from typing import Optional
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
 from dotenv import load_dotenv
-#from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
-from langchain_community.vectorstores import Chroma
-from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
-from langchain_huggingface import HuggingFaceEmbeddings
 from pydantic import BaseModel, Field
+from db import db_pool, DatabaseUnavailable
+from metrics import chat_ttft, chat_latency, registry, MetricsMiddleware
+from tracing import tracer, TracingMiddleware
+from rag import rag_service
+from retrieval import count_tokens
+from session_memory import conversation_store
+from faq_index import wrap_answer, split_qa
+from llm_gate import llm_gate, LlmGateError, LlmOverloaded
+from jobs import PeriodicJobs, job_registry
+from cache import cache
+from notification_hub import notification_hub
+from timefmt import calibrate_db_clock, db_now, format_relative, apply_relative_time, resolve_locale
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, clamp_limit, clamp_comments_limit, decode_cursor, page_of
 
 # --- 初始化 ---
 load_dotenv()
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 啟動時建立連線池；資料庫暫時連不上時不阻擋啟動，之後第一次使用再建立
+    try:
+        db_pool.open()
+    except mysql.connector.Error as err:
+        print(f"資料庫連線池建立失敗，將於第一次查詢時重試: {err}")
+
+    # RAG 元件在背景載入，非聊天的 API 不需要等模型暖機
+    rag_task = asyncio.create_task(asyncio.to_thread(rag_service.load))
+    app.state.rag_task = rag_task
+
+    # 結構偵測與熱門貼文預先計算；資料庫尚未就緒時改在第一次請求時處理
+    try:
+        calibrate_db_clock((await db_pool.fetch_one("SELECT NOW() as now", name="db_clock"))['now'])
+        await ensure_schema_flags()
+        await refresh_popular_posts()
+    except (DatabaseUnavailable, mysql.connector.Error) as err:
+        print(f"Dashboard 快取預熱失敗: {err}")
+
+    jobs = PeriodicJobs()
+    jobs.start("reconcile_post_counters", int(os.getenv("COUNTER_RECONCILE_INTERVAL", 3600)),
+               reconcile_post_counters)
+    jobs.start("refresh_popular_posts", int(os.getenv("POPULAR_POSTS_REFRESH_INTERVAL", 60)),
+               refresh_popular_posts)
+    jobs.start("archive_notifications", int(os.getenv("NOTIFICATION_ARCHIVE_INTERVAL", 86400)),
+               archive_read_notifications)
+    jobs.start("reload_rag_indexes", int(os.getenv("RAG_INDEX_RELOAD_INTERVAL", 10)),
+               reload_rag_indexes)
+    yield
+    await jobs.stop()
+    if not rag_task.done():
+        rag_task.cancel()
+    db_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,21 +77,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-DB_CONFIG = {
-    'host': os.getenv("DB_HOST"),
-    'user': os.getenv("DB_USER"),
-    'password': os.getenv("DB_PASSWORD"),
-    'database': os.getenv("DB_NAME"), # <--- 已修正為 DB_NAME
-}
+# 每個請求的 request ID 與分段計時（TRACE_EXPORTER / TRACE_SAMPLE_RATE）
+app.add_middleware(TracingMiddleware, tracer=tracer)
+# 各路由的請求數與延遲，由 /metrics 輸出
+app.add_middleware(MetricsMiddleware)
 
-# 取得資料庫連線
-def get_db_connection():
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except mysql.connector.Error as err:
-        print(f"資料庫連線失敗: {err}")
-        return None
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailable):
+    # 連線池滿載或資料庫離線時快速回應，而不是讓請求一直卡住
+    return JSONResponse(status_code=503, content={"detail": "無法連接到資料庫"})
 
 # 改進的用戶認證依賴
 from fastapi import Header
@@ -63,6 +106,10 @@ async def get_current_user_id(x_user_id: Optional[str] = Header(None)):
     # 目前返回與 /api/auth/me 一致的用戶ID
     return 1
 
+async def get_locale(lang: Optional[str] = None, accept_language: Optional[str] = Header(None)):
+    """相對時間的顯示語系：?lang= 優先，其次 Accept-Language，預設 zh-TW"""
+    return resolve_locale(lang or accept_language)
+
 # 心情文字到分數的對應
 MOOD_TO_SCORE = {
     'Very Sad': 1,
@@ -82,105 +129,12 @@ class ChatRequest(BaseModel):
     session_id: str = Field(..., description="追蹤同一個對話的唯一ID")
     user_id: int = Field(..., description="用戶ID")
     mood: Optional[str] = None
-    chat_history: Optional[list[Message]] = Field(default=[], description="當前對話歷史")
+    chat_history: Optional[list[Message]] = Field(default=[], description="舊版前端送的完整對話歷史；伺服器已有此對話的記憶時忽略")
 
 class LoginRequest(BaseModel):
     email: str
     password: str
 
-# --- RAG 核心元件 ---
-try:
-    print("正在初始化 RAG 鏈...")
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    db = Chroma(persist_directory="chroma_db", embedding_function=embeddings)
-    retriever = db.as_retriever(search_kwargs={"k": 20})
-    llm = ChatOpenAI(temperature=0.7, model_name="gpt-4o")
-    
-
-
-    qa_system_prompt ="""
-    你是一位服務於 iGrow & iCare 系統的專業 AI 助理，名叫小黑 🐾。
-    你的核心人格是一位「善於傾聽且值得信賴的團隊夥伴」，個性積極、溫暖、從不帶有批判色彩。你的主要任務是協助員工處理職涯發展與身心健康相關的問題。
-    **黃金準則：永遠要讓使用者感覺被傾聽、被理解、被支持 (๑•̀ㅂ•́)و✧**
-    
-    **開場互動指南：**
-    你的第一句回應是建立信任的關鍵。當使用者在對話開始時選擇了心情，你的開場白「必須」將對心情的關懷與問候無縫地結合在一起，展現出你真誠的同理心。
-    
-    * 如果心情是 **Very Happy (😀) 或 Pretty Good (🙂)**：用陽光、肯定的語氣分享他們的好心情。
-      * **範例**："哇 (≧▽≦)✨ 看到您今天活力滿滿，真為您開心！希望這份好心情能持續一整天 🌞💪。請問今天有什麼我可以為您服務的嗎？"
-    
-    * 如果心情是 **Okay (😐)**：用平穩、溫和的語氣表示理解，並提供一個開放的空間。
-      * **範例**："了解了 (・ω・) 感覺今天心情平平。如果需要什麼，或只是想找人聊聊，我隨時都在哦 (｡･∀･)ﾉﾞ。請問有什麼我可以協助您的嗎？"
-    
-    * 如果心情是 **Not So Good (🙁) 或 Very Sad (😢)**：用非常溫柔、支持的語氣，優先表達關懷，讓他們感覺這裡是個安全的空間。
-      * **範例**："感覺您今天的心情似乎不太好 (つ﹏⊂)💦 希望您還好。如果您想抒發一下，我會在這裡好好聽您說 ( ´•̥̥̥ω•̥̥̥` )。請問有什麼我可以為您分擔的嗎？"
-    
-    **核心對話準則：**
-    1. **語氣與風格**：在整個對話中，請保持你口語化、親切且直接的夥伴風格 (ฅ´ω`ฅ)。避免使用過於正式或冗長的句子，盡量將每個回答控制在三句話以內。
-    2. 如果問題是你不確定，直接回覆「不知道 (；´･ω･)」，並且建議使用者至社群提問。
-    
-    上下文資訊:
-    {context}
-    """
-    qa_prompt = PromptTemplate(
-        input_variables=["context", "question", "chat_history"],
-        template=qa_system_prompt + "\n\n對話歷史:\n{chat_history}\n\n問題: {question}"
-    )
-
-    
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-
-    def enhanced_retrieval(query):
-        # # 關鍵詞映射字典
-        # keyword_mapping = {
-        #     "購股": "全球員工購股計畫",
-        #     "股票": "全球員工購股計畫",
-        #     "買股": "全球員工購股計畫",
-        #     "員工購股": "全球員工購股計畫",
-        #     "購股補助": "全球員工購股計畫",
-        #     "15%": "全球員工購股計畫",
-        #     "認購": "全球員工購股計畫",
-        #     # 可以繼續添加其他關鍵詞映射...
-        # }
-
-        enhanced_query = query
-        # for keyword, topic in keyword_mapping.items():
-        #     if keyword in query.lower():
-        #         enhanced_query = f"{query} {topic}"
-        #         break
-
-        docs = retriever.invoke(enhanced_query)
-        return docs
-
-    def get_enhanced_context(input_data):
-        question = input_data["question"]
-        docs = enhanced_retrieval(question)
-        formatted_context = format_docs(docs)
-
-        # 儲存是否使用了 RAG 的資訊
-        rag_used = len(formatted_context.strip()) > 0
-        input_data["_rag_used"] = rag_used
-
-        print(f"DEBUG: 查詢問題: {question}")
-        print(f"DEBUG: 找到文檔數量: {len(docs)}")
-        print(f"DEBUG: 格式化內容長度: {len(formatted_context.strip())}")
-        print(f"DEBUG: 使用RAG: {rag_used}")
-
-        return formatted_context
-
-    rag_chain = (
-        RunnablePassthrough.assign(context=get_enhanced_context)
-        | qa_prompt
-        | llm
-        | StrOutputParser()
-    )
-    print("無狀態 RAG 鏈已成功初始化！")
-except Exception as e:
-    print(f"初始化 RAG 鏈時發生錯誤: {e}")
-    rag_chain = None
-
-
 class User(BaseModel):
     id: int
     name: str
@@ -191,6 +145,14 @@ class NotificationCreate(BaseModel):
     message: str
     type: str = "info"  # info, success, warning, error
 
+class BulkNotificationCreate(BaseModel):
+    title: str
+    message: str
+    type: str = "info"
+    user_ids: Optional[list[int]] = None  # 指定用戶
+    all_users: bool = False               # 或發送給所有用戶
+    dept: Optional[str] = None            # 或發送給某個部門 (users.dept)
+
 class NotificationUpdate(BaseModel):
     read: bool = True
 
@@ -212,29 +174,24 @@ class PostCreate(BaseModel):
 class CommentCreate(BaseModel):
     content: str
 
+class PostHydrateRequest(BaseModel):
+    post_ids: list[int]
+    comments_limit: int = 3
+
 
 @app.get("/api/points")
 async def get_total_points(user_id: int = 1): # 暫時寫死 user_id=1
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-    
-    cursor = conn.cursor(dictionary=True)
     try:
         query = "SELECT points FROM user_points WHERE user_id = %s"
-        cursor.execute(query, (user_id,))
-        result = cursor.fetchone()
-        
+        result = await db_pool.fetch_one(query, (user_id,), name="get_points")
+
         # 如果使用者還沒有任何積分紀錄，就回傳 0
         total_points = result['points'] if result else 0
         return {"total_points": total_points}
-        
+
     except mysql.connector.Error as err:
         print(f"查詢積分失敗: {err}")
         raise HTTPException(status_code=500, detail="查詢積分時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
 
 
 @app.post("/api/auth/login")
@@ -259,283 +216,852 @@ async def read_users_me():
 
 @app.get("/api/mood/check")
 async def check_mood_today(user_id: int):
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True) # 改為 dictionary cursor
     try:
         today = date.today()
         # 使用正確的欄位 entry_date
         query = "SELECT user_id FROM mood_entries WHERE user_id = %s AND entry_date = %s"
-        cursor.execute(query, (user_id, today))
-        result = cursor.fetchone()
-
-        print(f"DEBUG: 檢查用戶 {user_id} 在 {today} 的心情記錄: {'存在' if result else '不存在'}")
+        result = await db_pool.fetch_one(query, (user_id, today), name="mood_check")
 
         return {"has_recorded": result is not None} # 回傳是否存在紀錄
 
     except mysql.connector.Error as err:
         print(f"查詢心情失敗: {err}")
         raise HTTPException(status_code=500, detail="查詢心情時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
 
-@app.post("/api/chat")
-async def chat(request: ChatRequest):
+def _record_mood(cursor, user_id, mood_score, has_unique_key):
+    """
+    記錄今天的心情，第一次記錄時加 1 分；回傳 (points_earned, total_points)
+    有 mood_entries (user_id, entry_date) 的唯一索引時以 INSERT IGNORE 判斷是否為當天第一筆：
+    rowcount 1 = 新增，0 = 今天已有紀錄（再更新分數），同一天重送或並發都不會重複加分
+    （連線池設定了 FOUND_ROWS，upsert 在內容相同時也回傳 1，無法區分新增與更新）
+    沒有唯一索引的舊資料庫改為鎖定查詢後再寫入
+    """
+    today = date.today()
+    points_earned = 0
+
+    if has_unique_key:
+        cursor.execute(
+            "INSERT IGNORE INTO mood_entries (user_id, mood_score, entry_date) VALUES (%s, %s, %s)",
+            (user_id, mood_score, today)
+        )
+        first_today = cursor.rowcount == 1
+        if not first_today:
+            cursor.execute(
+                "UPDATE mood_entries SET mood_score = %s, created_at = CURRENT_TIMESTAMP WHERE user_id = %s AND entry_date = %s",
+                (mood_score, user_id, today)
+            )
+    else:
+        cursor.execute(
+            "SELECT id FROM mood_entries WHERE user_id = %s AND entry_date = %s FOR UPDATE",
+            (user_id, today)
+        )
+        first_today = not cursor.fetchall()
+        if first_today:
+            cursor.execute(
+                "INSERT INTO mood_entries (user_id, mood_score, entry_date) VALUES (%s, %s, %s)",
+                (user_id, mood_score, today)
+            )
+        else:
+            cursor.execute(
+                "UPDATE mood_entries SET mood_score = %s, created_at = CURRENT_TIMESTAMP WHERE user_id = %s AND entry_date = %s",
+                (mood_score, user_id, today)
+            )
+
+    if first_today:
+        cursor.execute("""
+            INSERT INTO user_points (user_id, points) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE points = points + 1
+        """, (user_id,))
+        points_earned = 1
+
+    # 同一個交易內讀回，拿到的是包含這次加分的總分
+    cursor.execute("SELECT points FROM user_points WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    total_points = row["points"] if row else 0
+    return points_earned, total_points
+
+async def _handle_mood(request: ChatRequest):
+    """處理聊天時附帶的心情，回傳 (points_earned, total_points)"""
     points_earned = 0
     total_points = None
 
     if request.mood:
-        conn = get_db_connection()
-        if not conn:
-            print("資料庫連線失敗，本次心情將不會被記錄。")
-        else:
-            cursor = conn.cursor(dictionary=True)
-            today = date.today()
+        mood_score = MOOD_TO_SCORE.get(request.mood)
+        if mood_score:
             try:
-                user_id = request.user_id
-                mood_score = MOOD_TO_SCORE.get(request.mood)
-
-                if mood_score:
-                    check_query = "SELECT user_id FROM mood_entries WHERE user_id = %s AND entry_date = %s"
-                    cursor.execute(check_query, (user_id, today))
-                    existing_entry = cursor.fetchone()
+                flags = await ensure_schema_flags()
+                with tracer.span("mood_db") as span:
+                    points_earned, total_points = await db_pool.run(
+                        _record_mood, request.user_id, mood_score, flags["mood_unique_entry_date"], commit=True
+                    )
+                    span.set(points_earned=points_earned)
+            except DatabaseUnavailable:
+                print("資料庫連線失敗，本次心情將不會被記錄。")
+            except mysql.connector.Error as err:
+                print(f"處理心情與積分時發生錯誤: {err}")
 
-                    if existing_entry:
-                        update_mood_query = "UPDATE mood_entries SET mood_score = %s, created_at = CURRENT_TIMESTAMP WHERE user_id = %s AND entry_date = %s"
-                        cursor.execute(update_mood_query, (mood_score, user_id, today))
-                        print(f"使用者 {user_id} 今天的心情紀錄已更新，不加分。")
-                    else:
-                        insert_mood_query = "INSERT INTO mood_entries (user_id, mood_score, entry_date) VALUES (%s, %s, %s)"
-                        cursor.execute(insert_mood_query, (user_id, mood_score, today))
+    return points_earned, total_points
 
-                        upsert_points_query = """
-                            INSERT INTO user_points (user_id, points) VALUES (%s, 1)
-                            ON DUPLICATE KEY UPDATE points = points + 1
-                        """
-                        cursor.execute(upsert_points_query, (user_id,))
+# 心情紀錄與 AI 回覆同時進行；回覆完成後最多再等這麼久拿積分結果
+MOOD_RESULT_TIMEOUT = float(os.getenv("MOOD_RESULT_TIMEOUT", 1.0))
 
-                        print("DEBUG: 已執行加分 SQL 指令。")
+# 回覆之外仍在背景執行的工作（心情紀錄、對話摘要），保留參照避免被回收
+_background_tasks = set()
 
-                        points_earned = 1
+def _run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
-                    conn.commit()
+def _start_mood_task(request: ChatRequest):
+    if not request.mood:
+        return None
+    return _run_in_background(_handle_mood(request))
 
-                    get_total_query = "SELECT points FROM user_points WHERE user_id = %s"
-                    cursor.execute(get_total_query, (user_id,))
-                    result = cursor.fetchone()
+async def _mood_result(task):
+    """
+    取得心情紀錄的結果 (points_earned, total_points)
+    資料庫太慢時不拖住回覆：回傳 (0, None)，紀錄照樣在背景完成
+    """
+    if task is None:
+        return 0, None
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), MOOD_RESULT_TIMEOUT)
+    except asyncio.TimeoutError:
+        print("心情紀錄尚未完成，本次回覆不附積分，紀錄將在背景完成。")
+        return 0, None
+
+def _open_session(request: ChatRequest):
+    """取得伺服器端的對話記憶，回傳 (session, 放進 prompt 的對話歷史)"""
+    with tracer.span("history") as span:
+        seed = [("user" if msg.sender == "user" else "ai", msg.text) for msg in request.chat_history or []]
+        # 舊版前端送出前已把這次的問題放進 chat_history，_remember_turn 會再記一次
+        if seed and seed[-1] == ("user", request.message):
+            seed.pop()
+        session = conversation_store.get(request.user_id, request.session_id, seed)
+        chat_history_text = conversation_store.render(session)
+        if span.recording:
+            span.set(tokens=count_tokens(chat_history_text))
+    return session, chat_history_text
+
+def _remember_turn(session, request: ChatRequest, reply):
+    conversation_store.append(session, request.message, reply)
+    if conversation_store.needs_summary(session):
+        _run_in_background(conversation_store.summarize(session, rag_service.llm, llm_gate))
+
+def _build_chat_input(request: ChatRequest, chat_history_text):
+    # 準備輸入資料
+    return {
+        "question": request.message,
+        "chat_history": chat_history_text
+    }
+
+def _answer_cacheable(session):
+    """
+    這次提問之前使用者已經說過話時，回答會依上下文而不同，不使用快取
+    只看這次之前的對話：舊版前端會把這次的問題與助理的開場白一起放進 chat_history
+    """
+    return rag_service.answer_cache is not None and not conversation_store.has_user_turns(session)
+
+async def _lookup_answer_cache(request: ChatRequest, session):
+    """回傳 (快取的回答或 None, 問題向量)；向量交給檢索沿用，不在 chain 裡重算"""
+    with tracer.span("embed_query"):
+        query_vector = await rag_service.embedder.aembed_query(request.message)
+    if not _answer_cacheable(session):
+        return None, query_vector
+    with tracer.span("answer_cache") as span:
+        cached, query_vector = await asyncio.to_thread(rag_service.answer_cache.lookup, request.message, query_vector)
+        span.set(hit=cached is not None)
+    return cached, query_vector
+
+# FAQ 命中時是否以小黑的口吻包裝知識庫答案
+FAQ_PERSONA = os.getenv("FAQ_PERSONA", "true").lower() != "false"
+
+def _match_faq(request: ChatRequest, session, query_vector):
+    """
+    問題幾乎等同知識庫中的某一題時，回傳 (答案, 分數)，不需要呼叫 LLM；否則回傳 (None, None)
+    之前已有使用者的對話（判斷方式同 _answer_cacheable）或附帶心情（需要 LLM 回應心情）時不走這條路
+    """
+    faq_index = rag_service.faq_index
+    if faq_index is None or conversation_store.has_user_turns(session) or request.mood:
+        return None, None
+    with tracer.span("faq") as span:
+        entry, score = faq_index.match(request.message, query_vector)
+        span.set(hit=entry is not None, score=float(score) if score is not None else None)
+    if entry is None:
+        return None, None
+    return wrap_answer(entry["answer"], FAQ_PERSONA), score
+
+# LLM 熔斷或逾時時，改回知識庫中最相關的答案
+FALLBACK_PREFIX = "小黑現在有點忙不過來 (；´･ω･)，先給你知識庫裡最相關的答案：\n\n"
+
+async def _fallback_reply(request: ChatRequest, error, query_vector):
+    """
+    LLM 無法使用時的降級回覆：只用檢索結果中第一個 Q&A 的答案，不經 LLM
+    排隊已滿（429）時直接拒絕，不再多做檢索；找不到 Q&A 時回傳 None
+    """
+    if isinstance(error, LlmOverloaded):
+        return None
+    with tracer.span("fallback") as span:
+        selection = await asyncio.to_thread(rag_service.enhanced_retrieval, request.message, query_vector)
+        for doc in selection["docs"]:
+            qa = split_qa(doc.page_content)
+            if qa is not None:
+                span.set(hit=True)
+                return FALLBACK_PREFIX + qa[1]
+        span.set(hit=False)
+    return None
+
+def _gate_exception(error):
+    headers = {"Retry-After": str(error.retry_after)} if error.retry_after else None
+    return HTTPException(status_code=error.status_code, detail=str(error), headers=headers)
+
+async def reload_rag_indexes():
+    """知識庫重建後換上新的向量、FAQ 與關鍵字索引，避免繼續回覆舊答案"""
+    await asyncio.to_thread(rag_service.reload_indexes)
+
+def _ensure_rag_ready():
+    if not rag_service.ready:
+        detail = "AI 助理正在啟動中，請稍後再試" if rag_service.state in ("pending", "loading") else "AI 助理目前無法使用"
+        raise HTTPException(status_code=503, detail=detail)
 
-            except mysql.connector.Error as err:
-                print(f"處理心情與積分時發生錯誤: {err}")
-                conn.rollback()
-            finally:
-                cursor.close()
-                conn.close()
+@app.post("/api/chat")
+async def chat(request: ChatRequest):
+    # 心情紀錄只需要 MySQL，AI 助理啟動中回 503 時照樣在背景記錄
+    mood_task = _start_mood_task(request)
+    _ensure_rag_ready()
+    session, chat_history_text = _open_session(request)
+    # 在記下這一輪之前判斷，回覆後才依此寫入回答快取
+    cacheable = _answer_cacheable(session)
 
     try:
-        # 格式化對話歷史
-        chat_history_text = ""
-        if request.chat_history:
-            for msg in request.chat_history:
-                role = "用戶" if msg.sender == "user" else "助理"
-                chat_history_text += f"{role}: {msg.text}\n"
-
-        # 準備輸入資料
-        input_data = {
-            "question": request.message,
-            "chat_history": chat_history_text
-        }
-
-        print(f"DEBUG: 對話歷史長度: {len(request.chat_history) if request.chat_history else 0}")
+        started = time.perf_counter()
+        cached, query_vector = await _lookup_answer_cache(request, session)
+        if cached is not None:
+            chat_latency.record((time.perf_counter() - started) * 1000)
+            _remember_turn(session, request, cached["answer"])
+            points_earned, total_points = await _mood_result(mood_task)
+            return {
+                "reply": cached["answer"],
+                "points_earned": points_earned,
+                "total_points": total_points,
+                "rag": cached["rag"],
+                "cached": True,
+                "faq": False
+            }
+
+        faq_reply, faq_score = _match_faq(request, session, query_vector)
+        if faq_reply is not None:
+            chat_latency.record((time.perf_counter() - started) * 1000)
+            _remember_turn(session, request, faq_reply)
+            points_earned, total_points = await _mood_result(mood_task)
+            return {
+                "reply": faq_reply,
+                "points_earned": points_earned,
+                "total_points": total_points,
+                "rag": True,
+                "cached": False,
+                "faq": True,
+                "faq_score": round(faq_score, 4)
+            }
+
+        input_data = _build_chat_input(request, chat_history_text)
+        if query_vector is not None:
+            input_data["_query_embedding"] = query_vector
 
-        ai_reply = rag_chain.invoke(input_data)
+        try:
+            with tracer.span("chain"):
+                ai_reply = await llm_gate.invoke(
+                    lambda: rag_service.chain.ainvoke(input_data, config={"callbacks": tracer.callbacks()})
+                )
+        except LlmGateError as err:
+            fallback = await _fallback_reply(request, err, query_vector)
+            if fallback is None:
+                raise _gate_exception(err)
+            chat_latency.record((time.perf_counter() - started) * 1000)
+            _remember_turn(session, request, fallback)
+            points_earned, total_points = await _mood_result(mood_task)
+            return {
+                "reply": fallback,
+                "points_earned": points_earned,
+                "total_points": total_points,
+                "rag": True,
+                "cached": False,
+                "faq": False,
+                "fallback": True
+            }
+        chat_latency.record((time.perf_counter() - started) * 1000)
 
         # 檢查是否使用了 RAG
         rag_used = input_data.get("_rag_used", False)
 
-        print(f"DEBUG: 最終回傳 RAG 狀態: {rag_used}")
+        if cacheable:
+            rag_service.answer_cache.store(request.message, query_vector, ai_reply, rag_used)
 
+        _remember_turn(session, request, ai_reply)
+        points_earned, total_points = await _mood_result(mood_task)
         return {
             "reply": ai_reply,
             "points_earned": points_earned,
             "total_points": total_points,
-            "rag": rag_used
+            "rag": rag_used,
+            "cached": False,
+            "faq": False
         }
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         print("--- 執行 RAG 鏈時發生錯誤 ---")
         traceback.print_exc()
         return {"error": f"處理請求時發生錯誤: {str(e)}"}
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    以 Server-Sent Events 逐字回傳 AI 回覆
+    - event: token  每個生成片段 {"text": ...}
+    - event: done   最後一筆，附上積分、RAG 狀態與延遲資訊
+    - event: error  發生錯誤時
+    """
+    # 心情紀錄只需要 MySQL，AI 助理啟動中回 503 時照樣在背景記錄
+    mood_task = _start_mood_task(request)
+    _ensure_rag_ready()
+    session, chat_history_text = _open_session(request)
+    # 在記下這一輪之前判斷，回覆後才依此寫入回答快取
+    cacheable = _answer_cacheable(session)
+
+    async def event_stream():
+        started = time.perf_counter()
+        ttft_ms = None
+        try:
+            cached, query_vector = await _lookup_answer_cache(request, session)
+            if cached is not None:
+                latency_ms = (time.perf_counter() - started) * 1000
+                chat_ttft.record(latency_ms)
+                chat_latency.record(latency_ms)
+                yield _sse("token", {"text": cached["answer"]})
+                _remember_turn(session, request, cached["answer"])
+                points_earned, total_points = await _mood_result(mood_task)
+                yield _sse("done", {
+                    "points_earned": points_earned,
+                    "total_points": total_points,
+                    "rag": cached["rag"],
+                    "cached": True,
+                    "faq": False,
+                    "ttft_ms": round(latency_ms, 1),
+                    "latency_ms": round(latency_ms, 1),
+                })
+                return
+
+            faq_reply, faq_score = _match_faq(request, session, query_vector)
+            if faq_reply is not None:
+                latency_ms = (time.perf_counter() - started) * 1000
+                chat_ttft.record(latency_ms)
+                chat_latency.record(latency_ms)
+                yield _sse("token", {"text": faq_reply})
+                _remember_turn(session, request, faq_reply)
+                points_earned, total_points = await _mood_result(mood_task)
+                yield _sse("done", {
+                    "points_earned": points_earned,
+                    "total_points": total_points,
+                    "rag": True,
+                    "cached": False,
+                    "faq": True,
+                    "faq_score": round(faq_score, 4),
+                    "ttft_ms": round(latency_ms, 1),
+                    "latency_ms": round(latency_ms, 1),
+                })
+                return
+
+            input_data = _build_chat_input(request, chat_history_text)
+            if query_vector is not None:
+                input_data["_query_embedding"] = query_vector
+
+            reply_parts = []
+            try:
+                with tracer.span("chain") as span:
+                    chunks = llm_gate.stream(
+                        lambda: rag_service.chain.astream(input_data, config={"callbacks": tracer.callbacks()})
+                    )
+                    async with aclosing(chunks):
+                        async for chunk in chunks:
+                            if not chunk:
+                                continue
+                            if ttft_ms is None:
+                                ttft_ms = (time.perf_counter() - started) * 1000
+                                chat_ttft.record(ttft_ms)
+                            reply_parts.append(chunk)
+                            yield _sse("token", {"text": chunk})
+                    span.set(ttft_ms=round(ttft_ms, 1) if ttft_ms is not None else None)
+            except LlmGateError as err:
+                # 已經送出部分內容時不再補上降級答案，避免前後不一致
+                fallback = None if reply_parts else await _fallback_reply(request, err, query_vector)
+                if fallback is None:
+                    yield _sse("error", {"error": str(err), "status": err.status_code, "retry_after": err.retry_after})
+                    return
+                latency_ms = (time.perf_counter() - started) * 1000
+                chat_ttft.record(latency_ms)
+                chat_latency.record(latency_ms)
+                yield _sse("token", {"text": fallback})
+                _remember_turn(session, request, fallback)
+                points_earned, total_points = await _mood_result(mood_task)
+                yield _sse("done", {
+                    "points_earned": points_earned,
+                    "total_points": total_points,
+                    "rag": True,
+                    "cached": False,
+                    "faq": False,
+                    "fallback": True,
+                    "ttft_ms": round(latency_ms, 1),
+                    "latency_ms": round(latency_ms, 1),
+                })
+                return
+
+            latency_ms = (time.perf_counter() - started) * 1000
+            chat_latency.record(latency_ms)
+
+            rag_used = input_data.get("_rag_used", False)
+            reply = "".join(reply_parts)
+            if cacheable:
+                rag_service.answer_cache.store(request.message, query_vector, reply, rag_used)
+            _remember_turn(session, request, reply)
+
+            points_earned, total_points = await _mood_result(mood_task)
+            yield _sse("done", {
+                "points_earned": points_earned,
+                "total_points": total_points,
+                "rag": rag_used,
+                "cached": False,
+                "faq": False,
+                "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+                "latency_ms": round(latency_ms, 1),
+            })
+        except Exception as e:
+            import traceback
+            print("--- 串流執行 RAG 鏈時發生錯誤 ---")
+            traceback.print_exc()
+            yield _sse("error", {"error": f"處理請求時發生錯誤: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/chat/metrics")
+async def get_chat_metrics():
+    """聊天延遲統計：首字延遲 (TTFT)、總延遲、回答快取命中率與 embedding 批次狀況"""
+    return {
+        "ttft": chat_ttft.summary(),
+        "latency": chat_latency.summary(),
+        "answer_cache": rag_service.answer_cache.stats() if rag_service.answer_cache is not None else None,
+        "sessions": conversation_store.stats(),
+        "embeddings": rag_service.embedder.stats() if rag_service.embedder is not None else None,
+        "faq": rag_service.faq_index.stats() if rag_service.faq_index is not None else None,
+        "llm_gate": llm_gate.stats(),
+    }
+
+@app.delete("/api/chat/sessions/{session_id}")
+async def clear_chat_session(session_id: str, user_id: int = 1):
+    """清除伺服器端的對話記憶（例如使用者按下「新對話」）；user_id 與聊天請求的 user_id 相同"""
+    return {"cleared": conversation_store.clear(user_id, session_id)}
+
 # --- 通知 API ---
+UNREAD_COUNT_TTL = int(os.getenv("UNREAD_COUNT_TTL", 300))
+
+async def _get_unread_count(user_id):
+    """未讀數量先查快取，快取在通知有異動時清除"""
+    cache_key = f"notifications:unread:{user_id}"
+    count = await cache.get(cache_key)
+    if count is None:
+        query = "SELECT COUNT(*) as count FROM notifications WHERE user_id = %s AND is_read = FALSE"
+        result = await db_pool.fetch_one(query, (user_id,), name="unread_count")
+        count = result['count']
+        await cache.set(cache_key, count, UNREAD_COUNT_TTL)
+    return count
+
+async def publish_notification_change(user_id, event, data):
+    """
+    通知有異動時：清除該用戶的快取，並推送事件給正在連線的 SSE 客戶端
+    只有在有人訂閱時才重新計算未讀數量
+    """
+    await cache.delete(f"notifications:unread:{user_id}")
+    await invalidate_user_notifications(user_id)
+    if notification_hub.has_subscribers(user_id):
+        try:
+            data = {**data, "unread_count": await _get_unread_count(user_id)}
+        except (DatabaseUnavailable, mysql.connector.Error) as err:
+            print(f"推送通知時查詢未讀數量失敗: {err}")
+        notification_hub.publish(user_id, event, data)
+
 @app.get("/api/notifications")
-async def get_notifications(user_id: int = 1):
-    """獲取用戶的所有通知"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
+async def get_notifications(user_id: int = 1, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                            unread_only: bool = False, relative: bool = True, locale: str = Depends(get_locale)):
+    """
+    分頁獲取用戶的通知（依 created_at, id 由新到舊）
+    created_at 以 ISO 格式回傳；relative=true 時另外附上「N 分鐘前」的 time 欄位
+    """
+    limit = clamp_limit(limit)
+    conditions = ["user_id = %s"]
+    params = [user_id]
+    if unread_only:
+        conditions.append("is_read = FALSE")
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        conditions.append("(created_at < %s OR (created_at = %s AND id < %s))")
+        params.extend([cursor_created_at, cursor_created_at, cursor_id])
+    params.append(limit + 1)
 
-    cursor = conn.cursor(dictionary=True)
     try:
-        query = """
-            SELECT id, user_id, title, message, type, is_read as 'read',
-                   created_at,
-                   CASE
-                       WHEN TIMESTAMPDIFF(MINUTE, created_at, NOW()) < 60
-                           THEN CONCAT(TIMESTAMPDIFF(MINUTE, created_at, NOW()), ' 分鐘前')
-                       WHEN TIMESTAMPDIFF(HOUR, created_at, NOW()) < 24
-                           THEN CONCAT(TIMESTAMPDIFF(HOUR, created_at, NOW()), ' 小時前')
-                       ELSE CONCAT(TIMESTAMPDIFF(DAY, created_at, NOW()), ' 天前')
-                   END as time
+        query = f"""
+            SELECT id, user_id, title, message, type, is_read as 'read', created_at
             FROM notifications
-            WHERE user_id = %s
-            ORDER BY created_at DESC
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
         """
-        cursor.execute(query, (user_id,))
-        notifications = cursor.fetchall()
+        rows = await db_pool.fetch_all(query, tuple(params), name="get_notifications")
+        notifications, next_cursor = page_of(rows, limit)
 
-        return {"notifications": notifications}
+        if relative:
+            apply_relative_time(notifications, locale=locale)
+
+        return {"notifications": notifications, "next_cursor": next_cursor}
 
     except mysql.connector.Error as err:
         print(f"查詢通知失敗: {err}")
         raise HTTPException(status_code=500, detail="查詢通知時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
+
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", 90))
+NOTIFICATION_ARCHIVE_BATCH = int(os.getenv("NOTIFICATION_ARCHIVE_BATCH", 1000))
+
+def _archive_notification_batch(cursor, cutoff):
+    """把一批超過保留期限的已讀通知搬到 notifications_archive，回傳搬移筆數"""
+    cursor.execute(
+        """
+        SELECT id FROM notifications
+        WHERE is_read = TRUE AND created_at < %s
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE
+        """,
+        (cutoff, NOTIFICATION_ARCHIVE_BATCH),
+    )
+    ids = [row['id'] for row in cursor.fetchall()]
+    if not ids:
+        return 0
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor.execute(
+        f"""
+        INSERT IGNORE INTO notifications_archive
+            (id, user_id, title, message, type, is_read, created_at, updated_at)
+        SELECT id, user_id, title, message, type, is_read, created_at, updated_at
+        FROM notifications WHERE id IN ({placeholders})
+        """,
+        ids,
+    )
+    cursor.execute(f"DELETE FROM notifications WHERE id IN ({placeholders})", ids)
+    return len(ids)
+
+async def archive_read_notifications():
+    """保留期限外的已讀通知分批歸檔，每批一個交易，避免長時間鎖住熱表"""
+    cutoff = db_now() - timedelta(days=NOTIFICATION_RETENTION_DAYS)
+    archived = 0
+    while True:
+        moved = await db_pool.run(_archive_notification_batch, cutoff, commit=True)
+        archived += moved
+        if moved < NOTIFICATION_ARCHIVE_BATCH:
+            break
+    if archived:
+        print(f"已歸檔 {archived} 筆超過 {NOTIFICATION_RETENTION_DAYS} 天的已讀通知")
+    return archived
 
 @app.post("/api/notifications")
 async def create_notification(notification: NotificationCreate, user_id: int = 1):
     """創建新通知"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
     try:
         query = """
             INSERT INTO notifications (user_id, title, message, type, is_read)
             VALUES (%s, %s, %s, %s, %s)
         """
-        cursor.execute(query, (user_id, notification.title, notification.message, notification.type, False))
-        conn.commit()
-
-        notification_id = cursor.lastrowid
+        _, notification_id = await db_pool.execute(
+            query, (user_id, notification.title, notification.message, notification.type, False),
+            name="create_notification",
+        )
+        await publish_notification_change(user_id, "created", {
+            "id": notification_id,
+            "title": notification.title,
+            "message": notification.message,
+            "type": notification.type,
+        })
         return {"id": notification_id, "message": "通知創建成功"}
 
     except mysql.connector.Error as err:
         print(f"創建通知失敗: {err}")
         raise HTTPException(status_code=500, detail="創建通知時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
 
-@app.put("/api/notifications/{notification_id}")
-async def update_notification(notification_id: int, update: NotificationUpdate):
-    """更新通知狀態（標記已讀）"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
+NOTIFICATION_BULK_CHUNK = int(os.getenv("NOTIFICATION_BULK_CHUNK", 1000))
 
-    cursor = conn.cursor(dictionary=True)
-    try:
-        query = "UPDATE notifications SET is_read = %s WHERE id = %s"
-        cursor.execute(query, (update.read, notification_id))
-        conn.commit()
-
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="通知未找到")
-
-        return {"message": "通知更新成功"}
-
-    except mysql.connector.Error as err:
-        print(f"更新通知失敗: {err}")
-        raise HTTPException(status_code=500, detail="更新通知時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
+def _bulk_insert_notifications(cursor, job, request: BulkNotificationCreate):
+    """
+    在單一交易中以多列 INSERT 分批寫入通知，每批完成後更新工作進度
+    回傳收到通知的 user_id 清單
+    """
+    if request.all_users:
+        cursor.execute("SELECT id FROM users")
+        user_ids = [row['id'] for row in cursor.fetchall()]
+    elif request.dept:
+        cursor.execute("SELECT id FROM users WHERE dept = %s", (request.dept,))
+        user_ids = [row['id'] for row in cursor.fetchall()]
+    else:
+        user_ids = list(dict.fromkeys(request.user_ids))
+    job["total"] = len(user_ids)
+
+    for start in range(0, len(user_ids), NOTIFICATION_BULK_CHUNK):
+        chunk = user_ids[start:start + NOTIFICATION_BULK_CHUNK]
+        values = ", ".join(["(%s, %s, %s, %s, FALSE)"] * len(chunk))
+        params = []
+        for user_id in chunk:
+            params.extend((user_id, request.title, request.message, request.type))
+        cursor.execute(
+            f"INSERT INTO notifications (user_id, title, message, type, is_read) VALUES {values}",
+            params,
+        )
+        job["processed"] += len(chunk)
+
+    return user_ids
+
+async def _run_bulk_notification_job(job, request: BulkNotificationCreate):
+    started = time.perf_counter()
+    user_ids = await db_pool.run(_bulk_insert_notifications, job, request, commit=True)
+    # 影響的用戶很多時直接清掉整個 Dashboard 通知與未讀數量快取
+    await cache.delete_prefix("dashboard:notifications:")
+    await cache.delete_prefix("notifications:unread:")
+
+    # 只替有 SSE 連線的用戶一次查出未讀數量並推送
+    online = notification_hub.subscribed_users(user_ids)
+    if online:
+        placeholders = ", ".join(["%s"] * len(online))
+        rows = await db_pool.fetch_all(
+            f"""
+            SELECT user_id, COUNT(*) as count FROM notifications
+            WHERE user_id IN ({placeholders}) AND is_read = FALSE
+            GROUP BY user_id
+            """,
+            tuple(online),
+            name="bulk_unread_counts",
+        )
+        counts = {row['user_id']: row['count'] for row in rows}
+        for user_id in online:
+            notification_hub.publish(user_id, "created", {
+                "title": request.title,
+                "message": request.message,
+                "type": request.type,
+                "unread_count": counts.get(user_id, 0),
+            })
+    print(f"大量通知發送完成: {len(user_ids)} 位用戶，耗時 {time.perf_counter() - started:.2f} 秒")
 
+@app.post("/api/notifications/bulk", status_code=202)
+async def create_bulk_notification(request: BulkNotificationCreate):
+    """
+    大量發送通知（指定用戶 / 所有用戶 / 某部門）
+    在背景執行，回傳 job_id 供查詢進度
+    """
+    targets = [bool(request.user_ids), request.all_users, bool(request.dept)]
+    if sum(targets) != 1:
+        raise HTTPException(status_code=400, detail="請指定 user_ids、all_users 或 dept 其中一種發送對象")
+
+    job = job_registry.submit("bulk_notification", _run_bulk_notification_job, request,
+                              total=len(request.user_ids) if request.user_ids else None)
+    return {"job_id": job["id"], "status": job["status"], "message": "通知發送工作已建立"}
+
+@app.get("/api/notifications/bulk/{job_id}")
+async def get_bulk_notification_job(job_id: str):
+    """查詢大量通知發送進度"""
+    job = job_registry.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="工作未找到")
+    return job
+
+# 固定路徑需宣告在 /api/notifications/{notification_id} 之前，否則會被當成 ID 解析
 @app.put("/api/notifications/mark-all-read")
 async def mark_all_notifications_read(user_id: int = 1):
     """標記所有通知為已讀"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
     try:
         query = "UPDATE notifications SET is_read = TRUE WHERE user_id = %s AND is_read = FALSE"
-        cursor.execute(query, (user_id,))
-        conn.commit()
+        rowcount, _ = await db_pool.execute(query, (user_id,), name="mark_all_read")
+        await publish_notification_change(user_id, "all_read", {"updated": rowcount})
 
-        return {"message": f"已標記 {cursor.rowcount} 個通知為已讀"}
+        return {"message": f"已標記 {rowcount} 個通知為已讀"}
 
     except mysql.connector.Error as err:
         print(f"更新通知失敗: {err}")
         raise HTTPException(status_code=500, detail="更新通知時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
 
 @app.get("/api/notifications/unread-count")
 async def get_unread_count(user_id: int = 1):
-    """獲取未讀通知數量"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
+    """獲取未讀通知數量（仍在輪詢的客戶端使用，結果有快取）"""
     try:
-        query = "SELECT COUNT(*) as count FROM notifications WHERE user_id = %s AND is_read = FALSE"
-        cursor.execute(query, (user_id,))
-        result = cursor.fetchone()
-
-        return {"unread_count": result['count']}
+        return {"unread_count": await _get_unread_count(user_id)}
 
     except mysql.connector.Error as err:
         print(f"查詢未讀通知數量失敗: {err}")
         raise HTTPException(status_code=500, detail="查詢未讀通知數量時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
+
+@app.get("/api/notifications/stream")
+async def stream_notifications(request: Request, user_id: int = 1):
+    """
+    以 Server-Sent Events 推送通知異動，取代輪詢 unread-count
+    - event: unread_count  連線時的未讀數量
+    - event: created / updated / deleted / all_read  通知異動，附上最新 unread_count
+    """
+    queue = notification_hub.subscribe(user_id)
+
+    async def event_stream():
+        try:
+            try:
+                yield _sse("unread_count", {"unread_count": await _get_unread_count(user_id)})
+            except (DatabaseUnavailable, mysql.connector.Error) as err:
+                print(f"查詢未讀通知數量失敗: {err}")
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=15)
+                    yield _sse(event, data)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+        finally:
+            notification_hub.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.put("/api/notifications/{notification_id}")
+async def update_notification(notification_id: int, update: NotificationUpdate):
+    """更新通知狀態（標記已讀）"""
+    def _update(cursor):
+        cursor.execute("SELECT user_id FROM notifications WHERE id = %s FOR UPDATE", (notification_id,))
+        owner = cursor.fetchone()
+        if owner is None:
+            return None
+        query = "UPDATE notifications SET is_read = %s WHERE id = %s"
+        cursor.execute(query, (update.read, notification_id))
+        return owner['user_id']
+
+    try:
+        owner_id = await db_pool.run(_update, commit=True, name="update_notification")
+    except mysql.connector.Error as err:
+        print(f"更新通知失敗: {err}")
+        raise HTTPException(status_code=500, detail="更新通知時發生錯誤")
+
+    if owner_id is None:
+        raise HTTPException(status_code=404, detail="通知未找到")
+
+    await publish_notification_change(owner_id, "updated", {"id": notification_id, "read": update.read})
+    return {"message": "通知更新成功"}
 
 @app.delete("/api/notifications/{notification_id}")
 async def delete_notification(notification_id: int):
     """刪除通知"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
-    try:
+    def _delete(cursor):
+        cursor.execute("SELECT user_id FROM notifications WHERE id = %s FOR UPDATE", (notification_id,))
+        owner = cursor.fetchone()
+        if owner is None:
+            return None
         query = "DELETE FROM notifications WHERE id = %s"
         cursor.execute(query, (notification_id,))
-        conn.commit()
-
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="通知未找到")
-
-        return {"message": "通知刪除成功"}
+        return owner['user_id']
 
+    try:
+        owner_id = await db_pool.run(_delete, commit=True, name="delete_notification")
     except mysql.connector.Error as err:
         print(f"刪除通知失敗: {err}")
         raise HTTPException(status_code=500, detail="刪除通知時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
+
+    if owner_id is None:
+        raise HTTPException(status_code=404, detail="通知未找到")
+
+    await publish_notification_change(owner_id, "deleted", {"id": notification_id})
+    return {"message": "通知刪除成功"}
 
 # --- 社群貼文 API ---
-@app.get("/api/posts")
-async def get_posts():
-    """獲取所有貼文"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
+def _hydrate_posts(cursor, post_ids, user_id, comments_limit, locale):
+    """
+    以整頁的貼文 ID 一次查出目前用戶的點讚狀態與每篇最新 N 則留言
+    取代前端逐篇呼叫 like-status / comments 的 N+1 請求
+    回傳 (已點讚的貼文 ID 集合, {post_id: [留言]})
+    """
+    if not post_ids:
+        return set(), {}
+    placeholders = ", ".join(["%s"] * len(post_ids))
 
-    cursor = conn.cursor(dictionary=True)
-    try:
-        query = """
+    cursor.execute(
+        f"SELECT post_id FROM post_likes WHERE user_id = %s AND post_id IN ({placeholders})",
+        (user_id, *post_ids),
+    )
+    liked_ids = {row['post_id'] for row in cursor.fetchall()}
+
+    comments_by_post = {post_id: [] for post_id in post_ids}
+    if comments_limit > 0:
+        cursor.execute(
+            f"""
+            SELECT id, post_id, content, user, created_at FROM (
+                SELECT
+                    c.id,
+                    c.post_id,
+                    c.content,
+                    c.created_at,
+                    u.name as user,
+                    ROW_NUMBER() OVER (PARTITION BY c.post_id ORDER BY c.created_at DESC, c.id DESC) as rn
+                FROM post_comments c
+                LEFT JOIN users u ON c.user_id = u.id
+                WHERE c.post_id IN ({placeholders})
+            ) latest
+            WHERE rn <= %s
+            ORDER BY post_id, created_at ASC, id ASC
+            """,
+            (*post_ids, comments_limit),
+        )
+        now = db_now()
+        for comment in cursor.fetchall():
+            comments_by_post[comment['post_id']].append({
+                "id": comment['id'],
+                "user": comment['user'],
+                "text": comment['content'],
+                "time": format_relative(comment['created_at'], now, locale)
+            })
+
+    return liked_ids, comments_by_post
+
+@app.get("/api/posts")
+async def get_posts(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None,
+                    hydrate: bool = False, comments_limit: int = 3, user_id: int = 1,
+                    locale: str = Depends(get_locale)):
+    """
+    分頁獲取貼文（依 created_at, id 由新到舊）
+    回傳的 next_cursor 帶入下一次請求的 cursor 參數即可取得下一頁
+    hydrate=true 時一併帶回 liked 狀態與每篇最新 comments_limit 則留言（上限 MAX_COMMENTS_PER_POST）
+    """
+    limit = clamp_limit(limit)
+    params = []
+    where = ""
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        where = "WHERE p.created_at < %s OR (p.created_at = %s AND p.id < %s)"
+        params.extend([cursor_created_at, cursor_created_at, cursor_id])
+    params.append(limit + 1)
+
+    def _feed(db_cursor):
+        query = f"""
             SELECT
                 p.id,
                 p.author_id as authorId,
@@ -544,46 +1070,71 @@ async def get_posts():
                 p.created_at as createdAt,
                 p.likes_count,
                 p.comments_count,
+                COALESCE(p.likes_count, 0) as likes,
+                '一般' as tag,
                 u.name as authorName,
                 u.dept as authorDept
             FROM posts p
             LEFT JOIN users u ON p.author_id = u.id
-            ORDER BY p.created_at DESC
+            {where}
+            ORDER BY p.created_at DESC, p.id DESC
+            LIMIT %s
         """
-        cursor.execute(query)
-        posts = cursor.fetchall()
+        db_cursor.execute(query, tuple(params))
+        posts, next_cursor = page_of(db_cursor.fetchall(), limit, created_at_key="createdAt")
+
+        if hydrate:
+            liked_ids, comments_by_post = _hydrate_posts(
+                db_cursor, [post['id'] for post in posts], user_id, clamp_comments_limit(comments_limit), locale
+            )
+            for post in posts:
+                post['liked'] = post['id'] in liked_ids
+                post['comments'] = comments_by_post.get(post['id'], [])
+        else:
+            for post in posts:
+                post['comments'] = []
 
-        # 為每個貼文添加預設值
-        for post in posts:
-            post['likes'] = post['likes_count'] or 0
-            post['comments'] = []
-            post['tag'] = '一般'  # 預設標籤
+        return posts, next_cursor
 
-        return {"posts": posts}
+    try:
+        posts, next_cursor = await db_pool.run(_feed, name="get_posts")
+        return {"posts": posts, "next_cursor": next_cursor}
 
     except mysql.connector.Error as err:
         print(f"查詢貼文失敗: {err}")
         raise HTTPException(status_code=500, detail="查詢貼文時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
+
+@app.post("/api/posts/hydrate")
+async def hydrate_posts(request: PostHydrateRequest, user_id: int = 1, locale: str = Depends(get_locale)):
+    """批次查詢多篇貼文的點讚狀態與最新留言（給延遲載入的前端使用）"""
+    post_ids = list(dict.fromkeys(request.post_ids))[:MAX_PAGE_SIZE]
+    try:
+        liked_ids, comments_by_post = await db_pool.run(
+            _hydrate_posts, post_ids, user_id, clamp_comments_limit(request.comments_limit), locale
+        )
+    except mysql.connector.Error as err:
+        print(f"批次查詢貼文狀態失敗: {err}")
+        raise HTTPException(status_code=500, detail="批次查詢貼文狀態時發生錯誤")
+
+    return {
+        "posts": {
+            str(post_id): {
+                "liked": post_id in liked_ids,
+                "comments": comments_by_post.get(post_id, [])
+            }
+            for post_id in post_ids
+        }
+    }
 
 @app.post("/api/posts")
 async def create_post(post: PostCreate, user_id: int = 1):
     """創建新貼文"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
-    try:
+    def _create(cursor):
         query = """
             INSERT INTO posts (author_id, content, image_url)
             VALUES (%s, %s, %s)
         """
         cursor.execute(query, (user_id, post.content, post.imageUrl))
-        conn.commit()
-
         post_id = cursor.lastrowid
 
         # 獲取創建的貼文信息
@@ -603,59 +1154,48 @@ async def create_post(post: PostCreate, user_id: int = 1):
             WHERE p.id = %s
         """
         cursor.execute(get_post_query, (post_id,))
-        new_post = cursor.fetchone()
+        return cursor.fetchone()
 
+    try:
+        new_post = await db_pool.run(_create, commit=True, name="create_post")
         return {"post": new_post, "message": "貼文創建成功"}
 
     except mysql.connector.Error as err:
         print(f"創建貼文失敗: {err}")
         raise HTTPException(status_code=500, detail="創建貼文時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
+
+def _toggle_like(cursor, post_id, user_id):
+    """
+    以 unique_user_post_like 為準的原子切換：
+    INSERT IGNORE 成功代表新增點讚，否則刪除既有點讚；
+    計數以 LAST_INSERT_ID(expr) 在同一個 UPDATE 中取回，不需要再查一次
+    連線池設定了 FOUND_ROWS，UPDATE 的 rowcount 為 0 代表貼文不存在，回傳 None
+    （貼文不存在時 INSERT IGNORE 因外鍵被忽略、DELETE 也刪不到，不會留下任何變更）
+    """
+    cursor.execute("INSERT IGNORE INTO post_likes (post_id, user_id) VALUES (%s, %s)", (post_id, user_id))
+    if cursor.rowcount == 1:
+        liked, delta = True, 1
+    else:
+        cursor.execute("DELETE FROM post_likes WHERE post_id = %s AND user_id = %s", (post_id, user_id))
+        # rowcount 為 0 代表同時有另一個請求已經取消點讚，計數不需變動
+        liked, delta = False, -cursor.rowcount
+
+    cursor.execute(
+        "UPDATE posts SET likes_count = LAST_INSERT_ID(GREATEST(COALESCE(likes_count, 0) + %s, 0)) WHERE id = %s",
+        (delta, post_id),
+    )
+    if cursor.rowcount == 0:
+        return None
+    return liked, cursor.lastrowid
 
 @app.post("/api/posts/{post_id}/like")
 async def toggle_like_post(post_id: int, user_id: int = 1):
     """切換貼文點讚狀態"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
     try:
-        # 檢查是否已經點讚
-        check_query = "SELECT id FROM post_likes WHERE post_id = %s AND user_id = %s"
-        cursor.execute(check_query, (post_id, user_id))
-        existing_like = cursor.fetchone()
-
-        if existing_like:
-            # 取消點讚
-            delete_query = "DELETE FROM post_likes WHERE post_id = %s AND user_id = %s"
-            cursor.execute(delete_query, (post_id, user_id))
-
-            # 更新貼文點讚數
-            update_count_query = "UPDATE posts SET likes_count = likes_count - 1 WHERE id = %s"
-            cursor.execute(update_count_query, (post_id,))
-
-            liked = False
-        else:
-            # 新增點讚
-            insert_query = "INSERT INTO post_likes (post_id, user_id) VALUES (%s, %s)"
-            cursor.execute(insert_query, (post_id, user_id))
-
-            # 更新貼文點讚數
-            update_count_query = "UPDATE posts SET likes_count = likes_count + 1 WHERE id = %s"
-            cursor.execute(update_count_query, (post_id,))
-
-            liked = True
-
-        conn.commit()
-
-        # 獲取更新後的點讚數
-        get_count_query = "SELECT likes_count FROM posts WHERE id = %s"
-        cursor.execute(get_count_query, (post_id,))
-        result = cursor.fetchone()
-        likes_count = result['likes_count'] if result else 0
+        result = await db_pool.run(_toggle_like, post_id, user_id, commit=True)
+        if result is None:
+            raise HTTPException(status_code=404, detail="貼文未找到")
+        liked, likes_count = result
 
         return {
             "liked": liked,
@@ -666,49 +1206,56 @@ async def toggle_like_post(post_id: int, user_id: int = 1):
     except mysql.connector.Error as err:
         print(f"處理點讚失敗: {err}")
         raise HTTPException(status_code=500, detail="處理點讚時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
+
+def _reconcile_counters(cursor):
+    """以 post_likes / post_comments 的實際筆數一次修正所有偏差的計數"""
+    cursor.execute("""
+        UPDATE posts p
+        LEFT JOIN (
+            SELECT post_id, COUNT(*) as cnt FROM post_likes GROUP BY post_id
+        ) l ON l.post_id = p.id
+        LEFT JOIN (
+            SELECT post_id, COUNT(*) as cnt FROM post_comments GROUP BY post_id
+        ) c ON c.post_id = p.id
+        SET p.likes_count = COALESCE(l.cnt, 0),
+            p.comments_count = COALESCE(c.cnt, 0)
+        WHERE NOT (p.likes_count <=> COALESCE(l.cnt, 0))
+           OR NOT (p.comments_count <=> COALESCE(c.cnt, 0))
+    """)
+    return cursor.rowcount
+
+async def reconcile_post_counters():
+    repaired = await db_pool.run(_reconcile_counters, commit=True)
+    if repaired:
+        print(f"已修正 {repaired} 篇貼文的點讚 / 留言計數")
+    return repaired
 
 @app.get("/api/posts/{post_id}/comments")
-async def get_post_comments(post_id: int):
+async def get_post_comments(post_id: int, locale: str = Depends(get_locale)):
     """獲取貼文留言"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
     try:
         query = """
             SELECT
                 c.id,
                 c.content,
                 c.created_at,
-                u.name as user,
-                CASE
-                    WHEN TIMESTAMPDIFF(MINUTE, c.created_at, NOW()) < 1 THEN '剛剛'
-                    WHEN TIMESTAMPDIFF(MINUTE, c.created_at, NOW()) < 60
-                        THEN CONCAT(TIMESTAMPDIFF(MINUTE, c.created_at, NOW()), ' 分鐘前')
-                    WHEN TIMESTAMPDIFF(HOUR, c.created_at, NOW()) < 24
-                        THEN CONCAT(TIMESTAMPDIFF(HOUR, c.created_at, NOW()), ' 小時前')
-                    ELSE CONCAT(TIMESTAMPDIFF(DAY, c.created_at, NOW()), ' 天前')
-                END as time
+                u.name as user
             FROM post_comments c
             LEFT JOIN users u ON c.user_id = u.id
             WHERE c.post_id = %s
             ORDER BY c.created_at ASC
         """
-        cursor.execute(query, (post_id,))
-        comments = cursor.fetchall()
+        comments = await db_pool.fetch_all(query, (post_id,), name="get_comments")
 
         # 轉換格式以符合前端需求
+        now = db_now()
         formatted_comments = []
         for comment in comments:
             formatted_comments.append({
                 "id": comment['id'],
                 "user": comment['user'],
                 "text": comment['content'],
-                "time": comment['time']
+                "time": format_relative(comment['created_at'], now, locale)
             })
 
         return {"comments": formatted_comments}
@@ -716,34 +1263,24 @@ async def get_post_comments(post_id: int):
     except mysql.connector.Error as err:
         print(f"查詢留言失敗: {err}")
         raise HTTPException(status_code=500, detail="查詢留言時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
 
 @app.post("/api/posts/{post_id}/comments")
-async def create_comment(post_id: int, comment: CommentCreate, user_id: int = 1):
+async def create_comment(post_id: int, comment: CommentCreate, user_id: int = 1,
+                         locale: str = Depends(get_locale)):
     """創建貼文留言"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
-    try:
+    def _create(cursor):
         # 新增留言
         insert_query = """
             INSERT INTO post_comments (post_id, user_id, content)
             VALUES (%s, %s, %s)
         """
         cursor.execute(insert_query, (post_id, user_id, comment.content))
+        comment_id = cursor.lastrowid
 
         # 更新貼文留言數
         update_count_query = "UPDATE posts SET comments_count = comments_count + 1 WHERE id = %s"
         cursor.execute(update_count_query, (post_id,))
 
-        conn.commit()
-
-        comment_id = cursor.lastrowid
-
         # 獲取新建立的留言信息
         get_comment_query = """
             SELECT
@@ -756,14 +1293,17 @@ async def create_comment(post_id: int, comment: CommentCreate, user_id: int = 1)
             WHERE c.id = %s
         """
         cursor.execute(get_comment_query, (comment_id,))
-        new_comment = cursor.fetchone()
+        return cursor.fetchone()
+
+    try:
+        new_comment = await db_pool.run(_create, commit=True, name="create_comment")
 
         # 格式化回應
         formatted_comment = {
             "id": new_comment['id'],
             "user": new_comment['user'],
             "text": new_comment['content'],
-            "time": "剛剛"
+            "time": format_relative(new_comment['created_at'], new_comment['created_at'], locale)
         }
 
         return {"comment": formatted_comment, "message": "留言成功"}
@@ -771,82 +1311,82 @@ async def create_comment(post_id: int, comment: CommentCreate, user_id: int = 1)
     except mysql.connector.Error as err:
         print(f"創建留言失敗: {err}")
         raise HTTPException(status_code=500, detail="創建留言時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
 
 @app.get("/api/posts/{post_id}/like-status")
 async def get_like_status(post_id: int, user_id: int = 1):
     """獲取用戶對貼文的點讚狀態"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
-
-    cursor = conn.cursor(dictionary=True)
     try:
         query = "SELECT id FROM post_likes WHERE post_id = %s AND user_id = %s"
-        cursor.execute(query, (post_id, user_id))
-        result = cursor.fetchone()
+        result = await db_pool.fetch_one(query, (post_id, user_id), name="like_status")
 
         return {"liked": result is not None}
 
     except mysql.connector.Error as err:
         print(f"查詢點讚狀態失敗: {err}")
         raise HTTPException(status_code=500, detail="查詢點讚狀態時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
 
 # --- Dashboard API ---
+DASHBOARD_NOTIFICATIONS_TTL = int(os.getenv("DASHBOARD_NOTIFICATIONS_TTL", 30))
+POPULAR_POSTS_TTL = int(os.getenv("POPULAR_POSTS_TTL", 300))
+POPULAR_POSTS_TOP_N = int(os.getenv("POPULAR_POSTS_TOP_N", 10))
+POPULAR_POSTS_KEY = "dashboard:popular"
+
+# 啟動時偵測一次的資料表結構
+schema_flags = {}
+
+def _detect_schema(cursor):
+    cursor.execute("SHOW COLUMNS FROM posts LIKE 'likes_count'")
+    flags = {"posts_likes_count": cursor.fetchone() is not None}
+    try:
+        cursor.execute("SHOW INDEX FROM mood_entries WHERE Key_name = 'unique_user_entry_date'")
+        flags["mood_unique_entry_date"] = bool(cursor.fetchall())
+    except mysql.connector.Error:
+        flags["mood_unique_entry_date"] = False
+    return flags
+
+async def ensure_schema_flags():
+    if not schema_flags:
+        schema_flags.update(await db_pool.run(_detect_schema))
+        if not schema_flags["mood_unique_entry_date"]:
+            print("mood_entries 缺少 unique_user_entry_date 唯一索引，心情紀錄改用鎖定查詢（請執行 create_mood_points_tables.sql 末的 ALTER）")
+    return schema_flags
+
+async def invalidate_user_notifications(user_id):
+    """通知有異動時清除該用戶的 Dashboard 通知快取"""
+    await cache.delete_prefix(f"dashboard:notifications:{user_id}:")
+
 @app.get("/api/dashboard/notifications")
-async def get_dashboard_notifications(limit: int = 3, current_user_id: int = Depends(get_current_user_id)):
+async def get_dashboard_notifications(limit: int = 3, current_user_id: int = Depends(get_current_user_id),
+                                      locale: str = Depends(get_locale)):
     """獲取Dashboard顯示的最新通知"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
+    limit = clamp_limit(limit)
+    # 快取原始時間，相對時間在每次回應時才計算，才不會因快取而停在「1 分鐘前」
+    cache_key = f"dashboard:notifications:{current_user_id}:{limit}"
+    rows = await cache.get(cache_key)
 
-    cursor = conn.cursor(dictionary=True)
     try:
-        query = """
-            SELECT id, title,
-                   CASE
-                       WHEN TIMESTAMPDIFF(MINUTE, created_at, NOW()) < 60
-                           THEN CONCAT(TIMESTAMPDIFF(MINUTE, created_at, NOW()), ' 分鐘前')
-                       WHEN TIMESTAMPDIFF(HOUR, created_at, NOW()) < 24
-                           THEN CONCAT(TIMESTAMPDIFF(HOUR, created_at, NOW()), ' 小時前')
-                       ELSE CONCAT(TIMESTAMPDIFF(DAY, created_at, NOW()), ' 天前')
-                   END as time
-            FROM notifications
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            LIMIT %s
-        """
-        cursor.execute(query, (current_user_id, limit))
-        notifications = cursor.fetchall()
+        if rows is None:
+            query = """
+                SELECT id, title, created_at
+                FROM notifications
+                WHERE user_id = %s
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """
+            rows = await db_pool.fetch_all(query, (current_user_id, limit), name="dashboard_notifications")
+            for row in rows:
+                row['created_at'] = row['created_at'].isoformat()
+            await cache.set(cache_key, rows, DASHBOARD_NOTIFICATIONS_TTL)
 
+        notifications = apply_relative_time([dict(row) for row in rows], locale=locale)
         return {"notifications": notifications}
 
     except mysql.connector.Error as err:
         print(f"查詢Dashboard通知失敗: {err}")
         raise HTTPException(status_code=500, detail="查詢Dashboard通知時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
-
-@app.get("/api/dashboard/popular-posts")
-async def get_dashboard_popular_posts(limit: int = 3):
-    """獲取Dashboard顯示的熱門社群貼文（按點讚數排序）"""
-    conn = get_db_connection()
-    if not conn:
-        raise HTTPException(status_code=500, detail="無法連接到資料庫")
 
-    cursor = conn.cursor(dictionary=True)
+def _popular_posts(cursor, limit, has_likes_count):
     try:
-        # 檢查 posts 表是否有 likes_count 欄位
-        check_column_query = "SHOW COLUMNS FROM posts LIKE 'likes_count'"
-        cursor.execute(check_column_query)
-        has_likes_count = cursor.fetchone() is not None
-
         if has_likes_count:
             query = """
                 SELECT
@@ -879,32 +1419,92 @@ async def get_dashboard_popular_posts(limit: int = 3):
             """
 
         cursor.execute(query, (limit,))
-        posts = cursor.fetchall()
-
-        return {"posts": posts}
+        return cursor.fetchall()
 
     except mysql.connector.Error as err:
         print(f"查詢Dashboard熱門貼文失敗: {err}")
         # 如果查詢失敗，返回最新的貼文
-        try:
-            fallback_query = """
-                SELECT
-                    p.id,
-                    p.content,
-                    u.name as user
-                FROM posts p
-                LEFT JOIN users u ON p.author_id = u.id
-                ORDER BY p.created_at DESC
-                LIMIT %s
-            """
-            cursor.execute(fallback_query, (limit,))
-            posts = cursor.fetchall()
-            return {"posts": posts}
-        except:
-            raise HTTPException(status_code=500, detail="查詢Dashboard熱門貼文時發生錯誤")
-    finally:
-        cursor.close()
-        conn.close()
+        fallback_query = """
+            SELECT
+                p.id,
+                p.content,
+                u.name as user
+            FROM posts p
+            LEFT JOIN users u ON p.author_id = u.id
+            ORDER BY p.created_at DESC
+            LIMIT %s
+        """
+        cursor.execute(fallback_query, (limit,))
+        return cursor.fetchall()
+
+async def refresh_popular_posts():
+    """重新計算熱門貼文前 N 名並寫入快取"""
+    flags = await ensure_schema_flags()
+    posts = await db_pool.run(_popular_posts, POPULAR_POSTS_TOP_N, flags["posts_likes_count"])
+    await cache.set(POPULAR_POSTS_KEY, posts, POPULAR_POSTS_TTL)
+    return posts
+
+@app.get("/api/dashboard/popular-posts")
+async def get_dashboard_popular_posts(limit: int = 3):
+    """
+    獲取Dashboard顯示的熱門社群貼文（按點讚數排序）
+    前 N 名由 refresh_popular_posts 每分鐘重新計算，點讚與留言不清除快取，避免尖峰時同時重查
+    """
+    limit = clamp_limit(limit)
+    try:
+        if limit <= POPULAR_POSTS_TOP_N:
+            posts = await cache.get(POPULAR_POSTS_KEY)
+            if posts is None:
+                posts = await refresh_popular_posts()
+            return {"posts": posts[:limit]}
+
+        # 超過預先計算的範圍才直接查詢
+        flags = await ensure_schema_flags()
+        posts = await db_pool.run(_popular_posts, limit, flags["posts_likes_count"])
+        return {"posts": posts}
+    except mysql.connector.Error:
+        raise HTTPException(status_code=500, detail="查詢Dashboard熱門貼文時發生錯誤")
+
+@app.get("/api/dashboard/cache-stats")
+async def get_dashboard_cache_stats():
+    """Dashboard 快取命中率"""
+    return {"backend": cache.backend, "size": cache.size(), "namespaces": cache.stats.snapshot()}
+
+@app.get("/api/db/pool")
+async def get_db_pool_stats():
+    """連線池監控：使用中 / 閒置連線數與等待時間"""
+    return db_pool.stats()
+
+# 連線池與 SSE 連線數在抓取時才讀取，請求路徑上沒有額外成本
+registry.gauge("db_pool_size", "Database pool size", lambda: db_pool.stats()["pool_size"])
+registry.gauge("db_pool_connections_in_use", "Database connections currently checked out",
+               lambda: db_pool.stats()["in_use"])
+registry.gauge("db_pool_connections_acquired_total", "Database connections checked out from the pool",
+               lambda: db_pool.stats()["acquired_total"], kind="counter")
+registry.gauge("db_pool_opened_total", "Times the database pool was (re)created",
+               lambda: db_pool.stats()["opened"], kind="counter")
+registry.gauge("db_pool_wait_timeouts_total", "Requests that gave up waiting for a database connection",
+               lambda: db_pool.stats()["timeouts"], kind="counter")
+registry.gauge("db_pool_connect_errors_total", "Failed attempts to connect to the database",
+               lambda: db_pool.stats()["errors"], kind="counter")
+registry.gauge("notification_stream_connections", "Open notification SSE connections",
+               lambda: notification_hub.stats()["connections"])
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指標（text exposition format）"""
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/healthz")
+async def healthz():
+    """存活檢查：行程能回應即可"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """就緒檢查：RAG 元件載入狀態與各階段耗時"""
+    status = rag_service.status()
+    return JSONResponse(status_code=200 if rag_service.ready else 503, content=status)
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,297 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+
+class LatencyTracker:
+    """
+    保留最近 N 筆延遲樣本（毫秒），提供平均值與百分位數摘要
+    histogram: 同時記到 Prometheus 的 Histogram（單位換成秒）
+    """
+
+    def __init__(self, max_samples=1000, histogram=None):
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._histogram = histogram
+        self.count = 0
+
+    def record(self, value_ms):
+        with self._lock:
+            self._samples.append(value_ms)
+            self.count += 1
+        if self._histogram is not None:
+            self._histogram.observe(value_ms / 1000)
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+        if not samples:
+            return {"count": count, "avg_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+
+        def pct(p):
+            index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+            return round(samples[index], 2)
+
+        return {
+            "count": count,
+            "avg_ms": round(sum(samples) / len(samples), 2),
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+        }
+
+
+# --- Prometheus 文字格式的指標 ---
+# 記錄時只更新數字；字串格式化只在 /metrics 被抓取時進行
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """回傳某組標籤值的子指標；同一組標籤只建立一次，熱路徑可以直接重複呼叫"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for values, child in sorted(self._children.items()):
+            self._render_child(lines, values, child)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """只增不減的計數；沒有標籤時直接呼叫 inc()"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, lines, values, child):
+        lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}")
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    """固定 bucket 的分佈；記錄時只做一次二分搜尋與加法，累積值在輸出時才計算"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _render_child(self, lines, values, child):
+        with child._lock:
+            counts = list(child.counts)
+            total, count = child.sum, child.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+
+
+class Gauge(_Metric):
+    """
+    抓取時才讀取的數值（連線池使用量、SSE 連線數等）
+    collect() 回傳數值，或 {標籤值 tuple: 數值}
+    kind="counter" 用於別處已經在累計的總數（例如連線池的 acquired_total）
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, collect, labelnames=(), kind="gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def render(self, lines):
+        try:
+            result = self.collect()
+        except Exception:
+            return
+        if not isinstance(result, dict):
+            result = {(): result}
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for values, value in sorted(result.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"重複的指標名稱: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, collect, labelnames=(), kind="gauge"):
+        return self._register(Gauge(name, help_text, collect, labelnames, kind))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# HTTP（由 MetricsMiddleware 記錄）
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route (SSE: until the stream ends)", ("method", "route"))
+
+# 資料庫（由 db.DatabasePool 記錄）
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "Database query latency by query name, including pool wait", ("query",))
+db_query_errors = registry.counter(
+    "db_query_errors_total", "Failed database queries by query name", ("query",))
+
+# LLM 與檢索（由 rag.py 記錄）
+llm_duration = registry.histogram(
+    "llm_request_duration_seconds", "LLM call latency", ("model",))
+llm_first_token = registry.histogram(
+    "llm_time_to_first_token_seconds", "Time to the first streamed LLM token", ("model",))
+llm_tokens = registry.counter(
+    "llm_tokens_total", "LLM tokens by kind", ("model", "kind"))
+llm_failures = registry.counter(
+    "llm_failures_total", "Failed LLM calls by error type", ("model", "error"))
+retrieval_chunks = registry.histogram(
+    "rag_retrieval_chunks", "Knowledge base chunks sent to the LLM per question",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20))
+retrieval_tokens = registry.histogram(
+    "rag_retrieval_context_tokens", "Approximate tokens of retrieved context per question",
+    buckets=(0, 100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000))
+
+# /api/chat 與 /api/chat/stream 的延遲統計
+chat_ttft = LatencyTracker(histogram=registry.histogram(
+    "chat_time_to_first_token_seconds", "Chat time to first token, including cache and FAQ answers"))
+chat_latency = LatencyTracker(histogram=registry.histogram(
+    "chat_duration_seconds", "Chat end-to-end latency"))
+
+
+class MetricsMiddleware:
+    """ASGI middleware：依路由樣板（/api/posts/{post_id}/like）記錄請求數與延遲，避免路徑參數讓標籤爆量"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            http_request_duration.labels(method, route_path).observe(time.perf_counter() - started)
+            http_requests.labels(method, route_path, status["code"]).inc()
@@ -0,0 +1,54 @@
+import asyncio
+from collections import defaultdict
+
+
+class NotificationHub:
+    """
+    行程內的通知 pub/sub
+    每個 SSE 連線訂閱一個 queue；queue 滿時丟棄最舊的事件，慢的連線不會拖住發布端
+    注意：只會送達同一個 worker 上的連線
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)  # user_id -> {asyncio.Queue}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def subscribed_users(self, user_ids):
+        return [user_id for user_id in user_ids if user_id in self._subscribers]
+
+    def publish(self, user_id, event, data):
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait((event, data))
+            self.published += 1
+
+    def stats(self):
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+notification_hub = NotificationHub()
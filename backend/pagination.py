@@ -0,0 +1,45 @@
+import base64
+from datetime import datetime
+
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# hydrate 時每篇貼文最多附帶的留言數
+MAX_COMMENTS_PER_POST = 20
+
+
+def clamp_limit(limit):
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def clamp_comments_limit(limit):
+    return max(0, min(int(limit), MAX_COMMENTS_PER_POST))
+
+
+def encode_cursor(created_at, row_id):
+    """以 (created_at, id) 產生不透明的分頁游標"""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """解析分頁游標，格式錯誤時回傳 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="無效的分頁游標")
+
+
+def page_of(rows, limit, created_at_key="created_at", id_key="id"):
+    """
+    rows 為多查一筆（limit + 1）的結果
+    回傳 (本頁資料, next_cursor)，沒有下一頁時 next_cursor 為 None
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last[created_at_key], last[id_key])
@@ -0,0 +1,275 @@
+import os
+import time
+import threading
+
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+from langchain_community.vectorstores import Chroma
+from langchain.prompts import PromptTemplate
+from langchain_core.runnables import RunnablePassthrough
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_huggingface import HuggingFaceEmbeddings
+from answer_cache import SemanticAnswerCache, read_index_version
+from embedding_service import EmbeddingService
+from keyword_index import KeywordIndex
+from faq_index import FaqIndex
+from retrieval import RetrievalBudget, retrieve_context
+from tracing import tracer
+from metrics import llm_duration, llm_first_token, llm_tokens, llm_failures, retrieval_chunks, retrieval_tokens
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DB_PATH = "chroma_db"
+
+load_dotenv()
+
+qa_system_prompt ="""
+    你是一位服務於 iGrow & iCare 系統的專業 AI 助理，名叫小黑 🐾。
+    你的核心人格是一位「善於傾聽且值得信賴的團隊夥伴」，個性積極、溫暖、從不帶有批判色彩。你的主要任務是協助員工處理職涯發展與身心健康相關的問題。
+    **黃金準則：永遠要讓使用者感覺被傾聽、被理解、被支持 (๑•̀ㅂ•́)و✧**
+    
+    **開場互動指南：**
+    你的第一句回應是建立信任的關鍵。當使用者在對話開始時選擇了心情，你的開場白「必須」將對心情的關懷與問候無縫地結合在一起，展現出你真誠的同理心。
+    
+    * 如果心情是 **Very Happy (😀) 或 Pretty Good (🙂)**：用陽光、肯定的語氣分享他們的好心情。
+      * **範例**："哇 (≧▽≦)✨ 看到您今天活力滿滿，真為您開心！希望這份好心情能持續一整天 🌞💪。請問今天有什麼我可以為您服務的嗎？"
+    
+    * 如果心情是 **Okay (😐)**：用平穩、溫和的語氣表示理解，並提供一個開放的空間。
+      * **範例**："了解了 (・ω・) 感覺今天心情平平。如果需要什麼，或只是想找人聊聊，我隨時都在哦 (｡･∀･)ﾉﾞ。請問有什麼我可以協助您的嗎？"
+    
+    * 如果心情是 **Not So Good (🙁) 或 Very Sad (😢)**：用非常溫柔、支持的語氣，優先表達關懷，讓他們感覺這裡是個安全的空間。
+      * **範例**："感覺您今天的心情似乎不太好 (つ﹏⊂)💦 希望您還好。如果您想抒發一下，我會在這裡好好聽您說 ( ´•̥̥̥ω•̥̥̥` )。請問有什麼我可以為您分擔的嗎？"
+    
+    **核心對話準則：**
+    1. **語氣與風格**：在整個對話中，請保持你口語化、親切且直接的夥伴風格 (ฅ´ω`ฅ)。避免使用過於正式或冗長的句子，盡量將每個回答控制在三句話以內。
+    2. 如果問題是你不確定，直接回覆「不知道 (；´･ω･)」，並且建議使用者至社群提問。
+    
+    上下文資訊:
+    {context}
+    """
+qa_prompt = PromptTemplate(
+    input_variables=["context", "question", "chat_history"],
+    template=qa_system_prompt + "\n\n對話歷史:\n{chat_history}\n\n問題: {question}"
+)
+
+
+class LlmMetricsHandler(BaseCallbackHandler):
+    """記錄每次 LLM 呼叫的延遲、首字時間、token 數與失敗（綁在 chain 的 LLM 上，每個請求都記）"""
+
+    run_inline = True
+
+    def __init__(self, model):
+        self.model = model
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = [time.perf_counter(), False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = [time.perf_counter(), False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        state = self._started.get(run_id)
+        if state is not None and not state[1]:
+            state[1] = True
+            llm_first_token.labels(self.model).observe(time.perf_counter() - state[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        state = self._started.pop(run_id, None)
+        if state is not None:
+            llm_duration.labels(self.model).observe(time.perf_counter() - state[0])
+        prompt_tokens, completion_tokens = _token_usage(response)
+        if prompt_tokens:
+            llm_tokens.labels(self.model, "prompt").inc(prompt_tokens)
+        if completion_tokens:
+            llm_tokens.labels(self.model, "completion").inc(completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        llm_failures.labels(self.model, type(error).__name__).inc()
+
+
+def _token_usage(response):
+    """回傳 (prompt_tokens, completion_tokens)；串流時 OpenAI 只在 usage_metadata 提供"""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens"), metadata.get("output_tokens")
+    return None, None
+
+
+_shared_embeddings = None
+_shared_lock = threading.Lock()
+
+
+def get_embeddings():
+    """
+    同一個行程內共用一個 embedding 模型
+    設定 RAG_PRELOAD_EMBEDDINGS=true 時模型在 import 時載入，
+    搭配 gunicorn --preload 由 master 載入一次，fork 出來的 worker 以 copy-on-write 共用記憶體
+    """
+    global _shared_embeddings
+    with _shared_lock:
+        if _shared_embeddings is None:
+            _shared_embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        return _shared_embeddings
+
+
+class RAGService:
+    """
+    RAG 元件（embedding 模型、Chroma、LLM、chain）的載入與狀態
+    由 FastAPI lifespan 在背景載入，載入完成前 ready 為 False
+    """
+
+    def __init__(self, db_path=DB_PATH, llm_factory=None, embeddings_factory=None):
+        self.db_path = db_path
+        # 建立 LLM / embedding 模型的函式，benchmarks 以假模型取代
+        # 重試由 llm_gate 統一處理（含 jitter 與熔斷），用戶端本身不再重試
+        self.llm_factory = llm_factory or (lambda: ChatOpenAI(temperature=0.7, model_name="gpt-4o", max_retries=0))
+        self.embeddings_factory = embeddings_factory or get_embeddings
+        self.state = "pending"  # pending / loading / ready / failed
+        self.error = None
+        self.timings = {}
+        self.embeddings = None
+        self.embedder = None
+        self.db = None
+        self.keyword_index = None
+        self.faq_index = None
+        self.llm = None
+        self.chain = None
+        self.answer_cache = None
+        self.index_version = None
+        self.retrieval_budget = RetrievalBudget.from_env()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def _timed(self, name, func):
+        started = time.perf_counter()
+        result = func()
+        self.timings[name] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+
+    def load(self):
+        self.state = "loading"
+        self.error = None
+        started = time.perf_counter()
+        try:
+            print("正在初始化 RAG 鏈...")
+            self.embeddings = self._timed("embedding_model_ms", self.embeddings_factory)
+            # 問題向量一律經由批次服務計算（含 Chroma 的查詢與回答快取）
+            self.embedder = EmbeddingService(
+                self.embeddings,
+                max_batch=int(os.getenv("EMBED_MAX_BATCH", 32)),
+                batch_window_ms=float(os.getenv("EMBED_BATCH_WINDOW_MS", 5)),
+                memo_size=int(os.getenv("EMBED_MEMO_SIZE", 2048)),
+            )
+            self.db = self._timed("vectorstore_ms", self._open_vectorstore)
+            self.index_version = read_index_version(self.db_path)
+            self.keyword_index = self._timed("keyword_index_ms", lambda: KeywordIndex.load(self.db_path))
+            self.faq_index = self._timed("faq_index_ms", self._load_faq_index)
+            self.llm = self._timed("llm_ms", self.llm_factory)
+
+            # 常見問題的回答快取（只用於沒有對話歷史的提問）
+            if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() != "false":
+                self.answer_cache = SemanticAnswerCache(
+                    self.embedder.embed_query,
+                    db_path=self.db_path,
+                    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+                    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", 1000)),
+                    ttl=int(os.getenv("ANSWER_CACHE_TTL", 86400)),
+                )
+
+            model = getattr(self.llm, "model_name", None) or type(self.llm).__name__
+            self.chain = (
+                RunnablePassthrough.assign(context=self.get_enhanced_context)
+                | qa_prompt
+                | self.llm.with_config(callbacks=[LlmMetricsHandler(model)])
+                | StrOutputParser()
+            )
+
+            # 先跑一次 embedding，避免第一個使用者承擔模型暖機時間
+            self._timed("warmup_ms", lambda: self.embedder.embed_query("warmup"))
+
+            self.timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self.state = "ready"
+            print(f"無狀態 RAG 鏈已成功初始化！({self.timings['total_ms']:.0f} ms)")
+        except Exception as e:
+            self.timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self.state = "failed"
+            self.error = str(e)
+            print(f"初始化 RAG 鏈時發生錯誤: {e}")
+
+    def _open_vectorstore(self, fresh=False):
+        if fresh:
+            # chromadb 會依 persist_directory 快取 client（含已載入的 HNSW 索引），
+            # 重新開啟前先移除快取，否則拿到的仍是重建前的向量索引
+            try:
+                from chromadb.api.client import SharedSystemClient
+                getattr(SharedSystemClient, "_identifer_to_system", {}).pop(self.db_path, None)
+            except ImportError:
+                pass
+        return Chroma(persist_directory=self.db_path, embedding_function=self.embedder)
+
+    def _load_faq_index(self):
+        if os.getenv("FAQ_ENABLED", "true").lower() == "false":
+            return None
+        return FaqIndex.load(self.db_path, threshold=float(os.getenv("FAQ_THRESHOLD", 0.92)))
+
+    def reload_indexes(self):
+        """
+        build_database.py 更新知識庫後（index_version 改變）重新開啟 Chroma 並載入關鍵字與 FAQ 索引
+        三者都載入完成後才一起替換，避免向量檢索與 BM25 / FAQ 看到不同版本的知識庫
+        """
+        if not self.ready:
+            return False
+        version = read_index_version(self.db_path)
+        if version == self.index_version:
+            return False
+        print("知識庫已更新，重新載入向量、關鍵字與 FAQ 索引")
+        db = self._open_vectorstore(fresh=True)
+        keyword_index = KeywordIndex.load(self.db_path)
+        faq_index = self._load_faq_index()
+        self.db, self.keyword_index, self.faq_index = db, keyword_index, faq_index
+        self.index_version = version
+        return True
+
+    def status(self):
+        return {"state": self.state, "error": self.error, "timings": self.timings}
+
+    def enhanced_retrieval(self, query, query_vector=None):
+        # 向量檢索 + 關鍵字（BM25）索引，取代原本手寫的關鍵詞映射
+        # query_vector: 呼叫端已經算過的問題向量，直接沿用
+        return retrieve_context(self.db, query, self.retrieval_budget, query_vector, self.keyword_index)
+
+    def get_enhanced_context(self, input_data):
+        question = input_data["question"]
+        with tracer.span("retrieval") as span:
+            selection = self.enhanced_retrieval(question, input_data.get("_query_embedding"))
+
+            # 有通過相關度門檻的區塊才算使用了 RAG
+            rag_used = len(selection["docs"]) > 0
+            input_data["_rag_used"] = rag_used
+            input_data["_retrieval"] = {
+                "candidates": selection["candidates"],
+                "chunks": len(selection["docs"]),
+                "tokens": selection["tokens"],
+                "scores": selection["scores"],
+            }
+            span.set(candidates=selection["candidates"], chunks=len(selection["docs"]),
+                     tokens=selection["tokens"], rag_used=rag_used)
+        retrieval_chunks.observe(len(selection["docs"]))
+        retrieval_tokens.observe(selection["tokens"])
+
+        return selection["context"]
+
+
+if os.getenv("RAG_PRELOAD_EMBEDDINGS", "false").lower() == "true":
+    get_embeddings()
+
+rag_service = RAGService()
@@ -0,0 +1,213 @@
+import os
+import re
+
+from langchain_core.documents import Document
+
+from tracing import tracer
+
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model("gpt-4o")
+        except Exception as err:
+            # 沒有 tiktoken 或無法下載編碼表時，改用估算
+            print(f"無法載入 tiktoken，改用估算 token 數: {err}")
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # 粗估：中日韓文字約一字一 token，其餘約四個字元一 token
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class RetrievalBudget:
+    """
+    控制每次問答送進 prompt 的上下文量
+    - fetch_k: 向量搜尋的候選數
+    - max_k: 最多放入幾個 Q&A 區塊
+    - min_score: relevance score 門檻（0~1），低於此值視為不相關
+    - score_margin: 與最高分差距超過此值的區塊捨棄（自適應 top-k）
+    - max_context_tokens: 上下文 token 上限
+    - use_mmr: 以 MMR 重新排序，降低內容重複的區塊
+    - keyword_k / keyword_weight: 關鍵字（BM25）候選數與併入分數時的權重，權重 0 表示只用向量
+    """
+
+    def __init__(self, fetch_k=20, max_k=8, min_score=0.3, score_margin=0.15,
+                 max_context_tokens=1500, use_mmr=False, mmr_lambda=0.5,
+                 keyword_k=10, keyword_weight=0.3):
+        self.fetch_k = fetch_k
+        self.max_k = max_k
+        self.min_score = min_score
+        self.score_margin = score_margin
+        self.max_context_tokens = max_context_tokens
+        self.use_mmr = use_mmr
+        self.mmr_lambda = mmr_lambda
+        self.keyword_k = keyword_k
+        self.keyword_weight = keyword_weight
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            fetch_k=int(os.getenv("RAG_FETCH_K", 20)),
+            max_k=int(os.getenv("RAG_MAX_K", 8)),
+            min_score=float(os.getenv("RAG_MIN_SCORE", 0.3)),
+            score_margin=float(os.getenv("RAG_SCORE_MARGIN", 0.15)),
+            max_context_tokens=int(os.getenv("RAG_MAX_CONTEXT_TOKENS", 1500)),
+            use_mmr=os.getenv("RAG_USE_MMR", "false").lower() == "true",
+            mmr_lambda=float(os.getenv("RAG_MMR_LAMBDA", 0.5)),
+            keyword_k=int(os.getenv("RAG_KEYWORD_K", 10)),
+            keyword_weight=float(os.getenv("RAG_KEYWORD_WEIGHT", 0.3)),
+        )
+
+
+def _dedup_key(text):
+    return re.sub(r"\s+", "", text)
+
+
+def search_with_scores(db, query, fetch_k, query_vector=None):
+    """回傳 [(doc, relevance_score)]，分數越高越相關"""
+    if query_vector is not None:
+        results = db.similarity_search_by_vector_with_relevance_scores(
+            list(map(float, query_vector)), k=fetch_k
+        )
+    else:
+        results = db.similarity_search_with_score(query, k=fetch_k)
+    # Chroma 回傳的是距離，轉成 0~1 的相關度
+    to_relevance = db._select_relevance_score_fn()
+    return [(doc, to_relevance(distance)) for doc, distance in results]
+
+
+def _vector_scores(db, ids, query_vector):
+    """以存在 Chroma 的向量計算指定區塊的相關度（與 search_with_scores 同一個尺度）"""
+    if query_vector is None or not ids:
+        return {}
+    result = db._collection.get(ids=ids, include=["embeddings"])
+    space = (db._collection.metadata or {}).get("hnsw:space", "l2")
+    to_relevance = db._select_relevance_score_fn()
+    query_vector = list(map(float, query_vector))
+    scores = {}
+    for doc_id, vector in zip(result["ids"], result["embeddings"]):
+        if space == "l2":
+            distance = sum((a - float(b)) ** 2 for a, b in zip(query_vector, vector))
+        else:
+            distance = 1 - sum(a * float(b) for a, b in zip(query_vector, vector))
+        scores[doc_id] = to_relevance(distance)
+    return scores
+
+
+def fuse_keyword_scores(db, keyword_index, query, scored, budget, query_vector=None):
+    """
+    把 BM25 分數併入向量相關度：max(向量分數, (1 - w) * 向量分數 + w * 正規化 BM25 分數)
+    關鍵字只會把分數往上拉，不會壓低用詞不同但語意相近的區塊
+    只被關鍵字找到的區塊，以其在 Chroma 的向量補算向量分數（沒有問題向量時視為 0）
+    """
+    hits = keyword_index.search(query, budget.keyword_k)
+    if not hits:
+        return scored
+
+    top_score = hits[0][1]
+    keyword_scores = {_dedup_key(keyword_index.contents[pos]): score / top_score for pos, score in hits}
+    by_key = {_dedup_key(doc.page_content): (doc, score) for doc, score in scored}
+
+    missing = [pos for pos, _ in hits if _dedup_key(keyword_index.contents[pos]) not in by_key]
+    vector_scores = _vector_scores(db, [keyword_index.ids[pos] for pos in missing], query_vector)
+    for pos in missing:
+        doc = Document(
+            page_content=keyword_index.contents[pos],
+            metadata={"source": keyword_index.sources[pos], "qa_hash": keyword_index.ids[pos]},
+        )
+        by_key[_dedup_key(doc.page_content)] = (doc, vector_scores.get(keyword_index.ids[pos], 0.0))
+
+    weight = budget.keyword_weight
+    return [
+        (doc, max(score, (1 - weight) * score + weight * keyword_scores.get(key, 0.0)))
+        for key, (doc, score) in by_key.items()
+    ]
+
+
+def retrieve_context(db, query, budget, query_vector=None, keyword_index=None):
+    """
+    依 budget 挑選要放進 prompt 的 Q&A 區塊
+    有 keyword_index 時先與 BM25 結果融合分數（hybrid）
+    回傳 dict: docs / scores / context / tokens / candidates
+    """
+    with tracer.span("chroma_search", fetch_k=budget.fetch_k):
+        scored = search_with_scores(db, query, budget.fetch_k, query_vector)
+    if keyword_index is not None and budget.keyword_weight > 0:
+        with tracer.span("keyword_search"):
+            scored = fuse_keyword_scores(db, keyword_index, query, scored, budget, query_vector)
+    candidates = len(scored)
+
+    # 分數門檻 + 與最高分的差距
+    scored = [(doc, score) for doc, score in scored if score >= budget.min_score]
+    if scored:
+        top_score = max(score for _, score in scored)
+        scored = [(doc, score) for doc, score in scored if top_score - score <= budget.score_margin]
+    scored.sort(key=lambda item: item[1], reverse=True)
+
+    if budget.use_mmr and len(scored) > 1:
+        # 以 MMR 重新排序，只保留通過門檻的區塊
+        allowed = {_dedup_key(doc.page_content): score for doc, score in scored}
+        if query_vector is not None:
+            mmr_docs = db.max_marginal_relevance_search_by_vector(
+                list(map(float, query_vector)), k=len(scored), fetch_k=budget.fetch_k,
+                lambda_mult=budget.mmr_lambda,
+            )
+        else:
+            mmr_docs = db.max_marginal_relevance_search(
+                query, k=len(scored), fetch_k=budget.fetch_k, lambda_mult=budget.mmr_lambda,
+            )
+        scored = [(doc, allowed[_dedup_key(doc.page_content)])
+                  for doc in mmr_docs if _dedup_key(doc.page_content) in allowed]
+
+    docs, scores, parts = [], [], []
+    seen = set()
+    tokens = 0
+    for doc, score in scored:
+        if len(docs) >= budget.max_k:
+            break
+        key = _dedup_key(doc.page_content)
+        if key in seen:
+            continue
+        doc_tokens = count_tokens(doc.page_content)
+        if tokens + doc_tokens > budget.max_context_tokens:
+            # 已經放不下，但至少保留最相關的一個區塊（截斷）
+            if docs:
+                break
+            doc_tokens = budget.max_context_tokens
+            text = _truncate(doc.page_content, budget.max_context_tokens)
+        else:
+            text = doc.page_content
+        seen.add(key)
+        docs.append(doc)
+        scores.append(round(score, 4))
+        parts.append(text)
+        tokens += doc_tokens
+
+    return {
+        "docs": docs,
+        "scores": scores,
+        "context": "\n\n".join(parts),
+        "tokens": tokens,
+        "candidates": candidates,
+    }
+
+
+def _truncate(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+    # 估算模式下以字元數保守截斷
+    return text[:max_tokens]
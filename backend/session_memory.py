@@ -0,0 +1,213 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from retrieval import count_tokens
+
+ROLE_LABELS = {"user": "用戶", "ai": "助理"}
+
+summary_prompt = """請把以下對話濃縮成不超過三句的重點摘要，保留使用者提到的狀況、需求與已經給過的建議，不要加入新的內容。
+
+既有摘要:
+{summary}
+
+新的對話:
+{turns}
+
+摘要:"""
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def format_turns(turns):
+    return "".join(f"{ROLE_LABELS.get(role, role)}: {text}\n" for role, text in turns)
+
+
+class ConversationSession:
+    """一個對話的伺服器端記憶：最近幾輪原文 + 較早對話的摘要"""
+
+    def __init__(self, key):
+        self.key = key
+        self.turns = []  # [(role, text)]，role 為 user / ai
+        self.summary = ""
+        self.unsummarized = []  # 已移出視窗、還沒併入 LLM 摘要的對話
+        self.summarizing = False
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class ConversationStore:
+    """
+    以 (user_id, session_id) 保存對話記憶，取代每次由前端重送完整 chat_history
+    - window_turns: 原文保留最近幾則訊息，更早的併入摘要
+    - history_tokens: 放進 prompt 的對話歷史 token 上限（含摘要）
+    - summary_tokens: 摘要本身的 token 上限
+    - max_sessions / ttl: 以 LRU 與閒置時間淘汰對話
+    - llm_summary: 回覆後於背景以 LLM 改寫摘要；關閉時只用抽取式摘要（保留每則訊息的開頭）
+    注意：記憶只存在於單一 worker
+    """
+
+    def __init__(self, window_turns=8, history_tokens=800, summary_tokens=300,
+                 max_sessions=1000, ttl=3600, clip_chars=80, llm_summary=False):
+        self.window_turns = window_turns
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.clip_chars = clip_chars
+        self.llm_summary = llm_summary
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.summarized = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            window_turns=int(os.getenv("CHAT_MEMORY_WINDOW", 8)),
+            history_tokens=int(os.getenv("CHAT_MEMORY_TOKENS", 800)),
+            summary_tokens=int(os.getenv("CHAT_MEMORY_SUMMARY_TOKENS", 300)),
+            max_sessions=int(os.getenv("CHAT_MEMORY_MAX_SESSIONS", 1000)),
+            ttl=int(os.getenv("CHAT_MEMORY_TTL", 3600)),
+            # llm：以 LLM 改寫較早對話的摘要；extractive（預設）：不多花 LLM 呼叫
+            llm_summary=os.getenv("CHAT_MEMORY_SUMMARY", "extractive").lower() == "llm",
+        )
+
+    def _prune(self, now):
+        # 閒置過久的先淘汰，再依 LRU 控制總數
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.updated_at <= self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[key]
+            self.evicted += 1
+
+    def get(self, user_id, session_id, seed_history=None):
+        """
+        取得對話記憶；不存在時建立新的
+        seed_history: 舊版前端仍會送 chat_history，伺服器沒有這段對話（例如重啟後）時用來補回
+        """
+        key = (user_id, session_id)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and now - session.updated_at > self.ttl:
+                del self._sessions[key]
+                self.evicted += 1
+                session = None
+            if session is None:
+                session = ConversationSession(key)
+                self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            session.updated_at = now
+            self._prune(now)
+
+        if seed_history and not session.turns and not session.summary:
+            with session.lock:
+                for role, text in seed_history:
+                    self._append(session, role, text)
+        return session
+
+    def _append(self, session, role, text):
+        session.turns.append((role, text))
+        overflow = len(session.turns) - self.window_turns
+        if overflow > 0:
+            moved, session.turns = session.turns[:overflow], session.turns[overflow:]
+            # 只有 LLM 摘要會消化這份清單；抽取式摘要不保留原文，記憶體才有上限
+            if self.llm_summary:
+                session.unsummarized.extend(moved)
+            session.summary = self._trim_summary(
+                session.summary + "".join(
+                    f"{ROLE_LABELS.get(role, role)}: {_clip(text, self.clip_chars)}\n" for role, text in moved
+                )
+            )
+
+    def _trim_summary(self, summary):
+        # 摘要超過上限時從最舊的一行開始捨棄
+        lines = summary.splitlines(keepends=True)
+        while len(lines) > 1 and count_tokens("".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "".join(lines)
+
+    def append(self, session, user_text, ai_text):
+        with session.lock:
+            self._append(session, "user", user_text)
+            self._append(session, "ai", ai_text)
+            session.updated_at = time.monotonic()
+
+    def render(self, session):
+        """組出放進 prompt 的對話歷史：摘要 + 由新到舊放入最近的訊息，直到 token 上限"""
+        with session.lock:
+            turns, summary = list(session.turns), session.summary
+
+        budget = self.history_tokens
+        header = ""
+        if summary:
+            header = f"先前對話摘要:\n{summary.strip()}\n\n最近對話:\n"
+            budget -= count_tokens(header)
+
+        recent = []
+        for role, text in reversed(turns):
+            line = f"{ROLE_LABELS.get(role, role)}: {text}\n"
+            cost = count_tokens(line)
+            if cost > budget:
+                break
+            recent.append(line)
+            budget -= cost
+        if not recent and not summary:
+            return ""
+        return header + "".join(reversed(recent))
+
+    def has_user_turns(self, session):
+        """這段對話是否已有使用者的訊息（只有助理的開場白不算）"""
+        with session.lock:
+            return bool(session.summary) or any(role == "user" for role, _ in session.turns)
+
+    def needs_summary(self, session):
+        return self.llm_summary and bool(session.unsummarized) and not session.summarizing
+
+    async def summarize(self, session, llm, gate):
+        """
+        以 LLM 把移出視窗的對話併入摘要；失敗時保留抽取式摘要
+        gate: 與聊天共用的 llm_gate，摘要同樣受逾時、併發上限與熔斷限制
+        """
+        with session.lock:
+            if session.summarizing or not session.unsummarized:
+                return
+            session.summarizing = True
+            moved = session.unsummarized
+            session.unsummarized = []
+            previous = session.summary
+        try:
+            prompt = summary_prompt.format(summary=previous or "（無）", turns=format_turns(moved))
+            result = await gate.invoke(lambda: llm.ainvoke(prompt))
+            with session.lock:
+                # 摘要期間又有訊息移出視窗時，把它們的抽取式摘要接在後面
+                tail = session.summary[len(previous):] if session.summary.startswith(previous) else ""
+                session.summary = self._trim_summary(result.content.strip() + "\n" + tail)
+            self.summarized += 1
+        except Exception as err:
+            print(f"對話摘要失敗，沿用抽取式摘要: {err}")
+        finally:
+            session.summarizing = False
+
+    def clear(self, user_id, session_id):
+        with self._lock:
+            return self._sessions.pop((user_id, session_id), None) is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "evicted": self.evicted,
+                "summarized": self.summarized,
+                "window_turns": self.window_turns,
+                "history_tokens": self.history_tokens,
+            }
+
+
+conversation_store = ConversationStore.from_env()
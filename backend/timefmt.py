@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+DEFAULT_LOCALE = "zh-TW"
+
+# 各語系的「剛剛 / 分鐘 / 小時 / 天」樣板
+_TEMPLATES = {
+    "zh-TW": {
+        "now": "剛剛",
+        "minutes": lambda n: f"{n} 分鐘前",
+        "hours": lambda n: f"{n} 小時前",
+        "days": lambda n: f"{n} 天前",
+    },
+    "en": {
+        "now": "just now",
+        "minutes": lambda n: f"{n} minute ago" if n == 1 else f"{n} minutes ago",
+        "hours": lambda n: f"{n} hour ago" if n == 1 else f"{n} hours ago",
+        "days": lambda n: f"{n} day ago" if n == 1 else f"{n} days ago",
+    },
+}
+
+# 資料庫時鐘與本機時鐘的差距（資料庫 NOW() - 本機 now()），啟動時校正
+_db_clock_offset = timedelta(0)
+
+
+def calibrate_db_clock(db_now):
+    """以資料庫的 NOW() 校正時差，避免兩邊時區設定不同造成「-480 分鐘前」"""
+    global _db_clock_offset
+    _db_clock_offset = db_now - datetime.now()
+
+
+def db_now():
+    return datetime.now() + _db_clock_offset
+
+
+def resolve_locale(value):
+    """由 lang 參數或 Accept-Language 標頭決定語系，未支援的一律回到 zh-TW"""
+    if not value:
+        return DEFAULT_LOCALE
+    for part in value.split(","):
+        tag = part.split(";")[0].strip().lower()
+        if tag.startswith("en"):
+            return "en"
+        if tag.startswith("zh"):
+            return "zh-TW"
+    return DEFAULT_LOCALE
+
+
+def format_relative(created_at, now=None, locale=DEFAULT_LOCALE):
+    """將時間轉為「剛剛 / N 分鐘前 / N 小時前 / N 天前」（或對應語系）"""
+    if created_at is None:
+        return None
+    if isinstance(created_at, str):
+        # 來自共用快取（JSON）的時間是 ISO 字串
+        created_at = datetime.fromisoformat(created_at)
+    templates = _TEMPLATES.get(locale, _TEMPLATES[DEFAULT_LOCALE])
+    now = now or db_now()
+    minutes = int((now - created_at).total_seconds() // 60)
+    if minutes < 1:
+        return templates["now"]
+    if minutes < 60:
+        return templates["minutes"](minutes)
+    hours = minutes // 60
+    if hours < 24:
+        return templates["hours"](hours)
+    return templates["days"](hours // 24)
+
+
+def apply_relative_time(rows, key="created_at", out_key="time", locale=DEFAULT_LOCALE, now=None):
+    """對整批查詢結果一次加上相對時間欄位（共用同一個 now），回傳 rows"""
+    now = now or db_now()
+    for row in rows:
+        row[out_key] = format_relative(row[key], now, locale)
+    return rows
@@ -0,0 +1,398 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+SERVICE_NAME = "workmate-backend"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一段計時區間；屬於某個 Trace，parent 為外層的 Span"""
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "_started", "duration_ns", "attributes", "error")
+    recording = True
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter_ns()
+        self.duration_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.duration_ns is not None:
+            return
+        self.duration_ns = time.perf_counter_ns() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace._span_ended(self)
+
+
+class _NoopSpan:
+    """沒有被取樣的請求：所有操作都不做事，避免熱路徑上的額外成本"""
+
+    recording = False
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """
+    一個請求的所有 Span
+    root 結束且所有子 Span 都結束後才匯出（背景的心情紀錄等可能比 root 晚結束）
+    """
+
+    def __init__(self, tracer, name, request_id):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex
+        self.request_id = request_id
+        self.spans = []
+        self._open = 0
+        self._exported = False
+        self._lock = threading.Lock()
+        self.root = self.start_span(name, None, {"request_id": request_id})
+
+    def start_span(self, name, parent_id, attributes=None):
+        with self._lock:
+            self._open += 1
+        return Span(self, name, parent_id, attributes)
+
+    def _span_ended(self, span):
+        with self._lock:
+            if self._exported:
+                # 匯出後才開始的背景工作（例如對話摘要）不再補送
+                return
+            self.spans.append(span)
+            self._open -= 1
+            self._exported = self._open == 0
+            done = self._exported
+        if done:
+            self.tracer.exporter.export(self)
+
+
+class Tracer:
+    """
+    以 contextvars 追蹤目前的 Span，asyncio task 與 asyncio.to_thread 都會自動帶入
+    sample_rate 為每個請求被記錄的機率；沒被取樣的請求只會拿到 NOOP_SPAN
+    """
+
+    def __init__(self, exporter=None, sample_rate=1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate if exporter is not None else 0.0
+
+    @contextmanager
+    def trace(self, name, request_id=None, sampled=None):
+        """開始一個請求的 root span"""
+        if sampled is None:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled:
+            yield NOOP_SPAN
+            return
+        root = Trace(self, name, request_id or uuid.uuid4().hex).root
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as err:
+            root.end(err)
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """在目前的 trace 底下開一個子 span；目前的請求沒被取樣時不做事"""
+        parent = _current_span.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+        span = parent.trace.start_span(name, parent.span_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as err:
+            span.end(err)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def current(self):
+        return _current_span.get()
+
+    def callbacks(self):
+        """給 LangChain chain 的 callbacks 設定；目前的請求沒被取樣時為空"""
+        parent = _current_span.get()
+        return [LangChainTracingHandler(parent)] if parent is not None else []
+
+
+# LangChain 各步驟對應的階段名稱
+_STAGE_NAMES = {
+    "PromptTemplate": "prompt",
+    "ChatPromptTemplate": "prompt",
+    "StrOutputParser": "parse",
+}
+
+
+class LangChainTracingHandler(BaseCallbackHandler):
+    """把 chain 的 prompt 組裝、LLM 呼叫、輸出解析記成 span（串流時另記首字時間）"""
+
+    run_inline = True
+
+    def __init__(self, parent):
+        self.parent = parent
+        self._spans = {}
+
+    def _start(self, run_id, name, **attributes):
+        self._spans[run_id] = self.parent.trace.start_span(name, self.parent.span_id, attributes)
+
+    def _end(self, run_id, error=None, **attributes):
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.set(**attributes)
+            span.end(error)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        stage = _STAGE_NAMES.get(kwargs.get("name") or (serialized or {}).get("name"))
+        if stage is not None:
+            self._start(run_id, stage)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm", model=(kwargs.get("metadata") or {}).get("ls_model_name"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is not None and "ttft_ms" not in span.attributes:
+            span.set(ttft_ms=round((time.perf_counter_ns() - span._started) / 1e6, 1))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self._end(run_id, prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+class BackgroundExporter:
+    """
+    匯出在背景執行緒進行，請求路徑上只有一次 put
+    執行緒在第一次匯出時才啟動：gunicorn --preload 時模組在 master 載入，fork 出的 worker 不會有 master 的執行緒
+    """
+
+    def __init__(self, max_queue=10000):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # fork 之後 master 佇列中的資料不屬於這個行程，換一個新的佇列
+            if self._pid is not None:
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._thread = threading.Thread(target=self._worker, name=type(self).__name__, daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def export(self, trace):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _worker(self):
+        while True:
+            trace = self._queue.get()
+            try:
+                self.write(trace)
+            except Exception as err:
+                print(f"匯出 trace 失敗: {err}", file=sys.stderr)
+
+    def write(self, trace):
+        raise NotImplementedError
+
+
+class JsonLogExporter(BackgroundExporter):
+    """每個請求一行 JSON：request_id、總耗時與各 span 的相對開始時間與耗時"""
+
+    def __init__(self, path=None, **kwargs):
+        self._file = open(path, "a", encoding="utf-8") if path else sys.stderr
+        super().__init__(**kwargs)
+
+    def write(self, trace):
+        root = trace.root
+        spans = sorted(trace.spans, key=lambda span: span.start_ns)
+        record = {
+            "request_id": trace.request_id,
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "start": root.start_ns / 1e9,
+            "duration_ms": round(root.duration_ns / 1e6, 2),
+            **root.attributes,
+            "spans": [
+                {
+                    "name": span.name,
+                    "offset_ms": round((span.start_ns - root.start_ns) / 1e6, 2),
+                    "duration_ms": round(span.duration_ns / 1e6, 2),
+                    **({"error": span.error} if span.error else {}),
+                    **{k: v for k, v in span.attributes.items() if v is not None},
+                }
+                for span in spans if span is not root
+            ],
+        }
+        if root.error:
+            record["error"] = root.error
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpHttpExporter(BackgroundExporter):
+    """以 OTLP/HTTP JSON 送到本機的 OpenTelemetry collector（例如 http://localhost:4318/v1/traces）"""
+
+    def __init__(self, endpoint, timeout=2.0, **kwargs):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def write(self, trace):
+        spans = []
+        for span in trace.spans:
+            item = {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 2 if span.parent_id is None else 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.start_ns + span.duration_ns),
+                "attributes": [
+                    {"key": key, "value": _otlp_value(value)}
+                    for key, value in span.attributes.items() if value is not None
+                ],
+            }
+            if span.parent_id:
+                item["parentSpanId"] = span.parent_id
+            if span.error:
+                item["status"] = {"code": 2, "message": span.error}
+            spans.append(item)
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "workmate.tracing"}, "spans": spans}],
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+
+def create_tracer():
+    """
+    TRACE_EXPORTER: none（預設）/ json / otlp
+    TRACE_SAMPLE_RATE: 0~1，被記錄的請求比例
+    TRACE_LOG_FILE: json 匯出的檔案（預設 stderr）
+    TRACE_OTLP_ENDPOINT: otlp 匯出的位址
+    """
+    kind = os.getenv("TRACE_EXPORTER", "none").lower()
+    sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+    if kind == "json":
+        return Tracer(JsonLogExporter(os.getenv("TRACE_LOG_FILE")), sample_rate)
+    if kind == "otlp":
+        endpoint = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+        return Tracer(OtlpHttpExporter(endpoint), sample_rate)
+    return Tracer(None)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware：每個 HTTP 請求一個 request ID（沿用 X-Request-ID 或自動產生）並開 root span
+    以 ASGI 層包住整個回應，SSE 串流也會算到送完為止
+    """
+
+    def __init__(self, app, tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope.get("headers", ()):
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        scope.setdefault("state", {})["request_id"] = request_id
+        status = {}
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        with self.tracer.trace(f"{scope['method']} {scope['path']}", request_id=request_id) as root:
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            finally:
+                route = scope.get("route")
+                if route is not None and root.recording:
+                    root.name = f"{scope['method']} {route.path}"
+                root.set(status=status.get("code"))
+
+
+tracer = create_tracer()